@@ -1,15 +1,20 @@
-from video_generator.generator import generate_video as generate_video_as_function
 from reddit_scraper import RedditScraper
+from jobs import JobQueue, QueueFull, build_render_kwargs
+from batch import submit_batch, get_batch_report
+from video_generator.mux import preview_path
+from video_generator.encoder_profiles import load_encoder_profiles
+from video_generator.timings import TIMING_SOURCES
+from video_generator.timeline import ENGINES
 
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, jsonify, request, send_file
 from flask_cors import CORS
 
 import json
 import os
-import glob
-import shutil
 import re
 
+from config import QUALITY_LEVELS
+
 class Config:
     def __init__(self, config_path):
         self.config_path = config_path
@@ -108,9 +113,21 @@ class StoryConfig(Config):
 
         self.save_config(self.config_path, config)
 
+def draft_output_path(video_output_path):
+    root, ext = os.path.splitext(video_output_path)
+    return f"{root}_draft{ext}"
+
+def is_listed_video(file_name):
+    """Finished final renders only: drafts and previews are renditions of one, hidden files are still being written."""
+    root, _ = os.path.splitext(file_name)
+    return not file_name.startswith(".") and not file_name.endswith(".tmp") and not root.endswith(("_draft", "_preview"))
+
 app = Flask(__name__)
 CORS(app)
 reddit = RedditScraper("reddit_config.json")
+jobs = JobQueue()
+# Stories of each batch that couldn't be queued, keyed by batch id
+batches = {}
 
 @app.route('/get_stories', methods=['GET'])
 def get_stories():
@@ -213,75 +230,71 @@ def delete_video_config(video_config_filename):
 @app.route('/get_video/<path:video_output_path>', methods=['GET'])
 def get_video(video_output_path):
     app.logger.info(f"Requested video: {video_output_path}")
+    # ?rendition=preview serves the lower bitrate copy written with preview_rendition
+    if request.args.get("rendition") == "preview":
+        video_output_path = preview_path(video_output_path)
     if os.path.exists(video_output_path):
-        return send_file(video_output_path, mimetype='video/mp4')
+        # Range requests get 206 partial responses, so players seek without downloading
+        # the whole file. Revalidating with the ETag and Last-Modified picks up re-renders.
+        response = send_file(os.path.abspath(video_output_path), mimetype='video/mp4', conditional=True, etag=True, max_age=0)
+        response.headers["Accept-Ranges"] = "bytes"
+        return response
     else:
         app.logger.error(f"Video not found: {video_output_path}")
         return jsonify({"error": f"Video file not found: {video_output_path}"}), 404
 
-def cleanup_temp_files():
-    """Clean up temporary files that might be created in the main directory."""
-    # Check for temp files in main directory and move them to temp folder
-    temp_patterns = [
-        "*TEMP_MPY*", "*temp*", "*_without_captions*", 
-        "*.mpy", "*.m4a", "*_TEMP_*", "*.wav.tmp*",
-        "*.wav", "*.mp3.tmp*", "*_*_*_*-*-*-"
-    ]
-    
-    print("Cleaning up temporary files...")
-    cleanup_dir = os.path.join("temp", "cleanup")
-    os.makedirs(cleanup_dir, exist_ok=True)
-    
-    # Current working directory files that match patterns
-    for pattern in temp_patterns:
-        for file in glob.glob(pattern):
-            try:
-                if os.path.isfile(file) and not file.startswith(("output/", "temp/", "assets/")):
-                    target_path = os.path.join(cleanup_dir, os.path.basename(file))
-                    print(f"Moving temporary file {file} to {target_path}")
-                    # If the file is in use, this might fail, so we try a copy+delete approach
-                    try:
-                        shutil.move(file, target_path)
-                    except:
-                        try:
-                            shutil.copy2(file, target_path)
-                            try:
-                                os.remove(file)
-                            except:
-                                print(f"Couldn't delete {file}, will try again later")
-                        except Exception as e:
-                            print(f"Couldn't copy {file}: {e}")
-            except Exception as e:
-                print(f"Error handling {file}: {e}")
-    
-    print("Cleanup completed")
-
 @app.route('/generate_video', methods=['POST'])
 def generate_video():
     try:
-        # Set up temp directory environment variable 
-        # (must be set each time because Flask may create a new process)
-        temp_dir = os.path.abspath("temp")
-        os.makedirs(temp_dir, exist_ok=True)
-        os.environ['MOVIEPY_TEMP_DIR'] = temp_dir
-        os.environ['TMPDIR'] = temp_dir
-        
-        # First clean up any temp files from previous runs
-        cleanup_temp_files()
-        
         data = request.json
         story_filename = data["story_filename"]
         video_filename = data["video_filename"]
         
         # Get CPU count for optimal parallel processing
-        import multiprocessing
-        cpu_count = multiprocessing.cpu_count()
-        max_workers = min(cpu_count, 8)  # Use up to 8 workers or available CPUs, whichever is less
-        print(f"Using {max_workers} workers for parallel processing (from {cpu_count} available CPUs)")
+        max_workers = jobs.threads_per_job()
+        print(f"Using {max_workers} workers for parallel processing")
         
         # Check if fast mode is requested
         fast_mode = data.get("fast_mode", True)  # Default to True for maximum speed
         print(f"Fast mode is {'enabled' if fast_mode else 'disabled'}")
+
+        # Burn captions in during the first encode unless the two-pass fallback is requested
+        single_pass = data.get("single_pass", True)
+        print(f"Rendering in {'a single pass' if single_pass else 'two passes'}")
+
+        # Caption timings come from the TTS alignment unless Whisper is asked for
+        timing_source = data.get("timing_source", "alignment")
+        if timing_source not in TIMING_SOURCES:
+            return jsonify({"error": f"Unknown timing_source: {timing_source}"}), 400
+
+        # Above 1 the final encode is split into that many time slices encoded side by side.
+        # Capped at the job's share of the CPUs, like max_workers
+        encode_workers = data.get("encode_workers", 1)
+        try:
+            # Fractions and booleans are rejected rather than truncated
+            valid = not isinstance(encode_workers, bool) and float(encode_workers).is_integer() and float(encode_workers) >= 1
+        except (TypeError, ValueError, OverflowError):
+            valid = False
+        if not valid:
+            return jsonify({"error": f"encode_workers must be a whole number of at least 1, got {data.get('encode_workers')!r}"}), 400
+        encode_workers = min(int(float(encode_workers)), max_workers)
+
+        # "ffmpeg" composites through raw ffmpeg pipes instead of moviepy clips
+        engine = data.get("engine", "moviepy")
+        if engine not in ENGINES:
+            return jsonify({"error": f"Unknown engine: {engine}"}), 400
+
+        # "draft" renders a small, quick preview that can be promoted to final later
+        quality = data.get("quality", "final")
+        # Also write a lower bitrate rendition, served by /get_video?rendition=preview
+        preview_rendition = data.get("preview_rendition", False)
+
+        # Encoder settings tuned for this host by tune_encoder.py, see /encoder_profiles
+        encoder_profile = data.get("encoder_profile")
+        if encoder_profile and encoder_profile not in load_encoder_profiles():
+            return jsonify({"error": f"Unknown encoder profile: {encoder_profile}"}), 400
+        if quality not in QUALITY_LEVELS:
+            return jsonify({"error": f"Unknown quality: {quality}"}), 400
         
         story_config = StoryConfig(os.path.join("story_configs", story_filename))
         video_config = VideoConfig(os.path.join("video_configs", video_filename))
@@ -295,60 +308,135 @@ def generate_video():
         video_config.update_config_by_key("main_text", story_config.config["content"])
         video_config.update_config_by_key("title_text", story_config.config["title"])
         video_config.update_config_by_key("video_output_path", video_output_path)
+        metadata = {
+            "story_filename": story_filename,
+            "video_filename": video_filename,
+            "quality": quality
+        }
+        if quality == "draft":
+            # The draft doesn't overwrite an approved final render of the story
+            metadata["final_output_path"] = video_output_path
+            video_output_path = draft_output_path(video_output_path)
 
-        # Start time for performance measurement
-        import time
-        start_time = time.time()
-        
-        generate_video_as_function(
-            video_config.config["main_text"],
-            video_config.config["title_text"],
-            video_config.config["video_output_path"],
-            video_config.config["background_clips_folder"],
-            video_config.config["temp_voices_folder"],
-            video_config.config["temp_audio_folder"],
-            video_config.config["capitalize"],
-            video_config.config["audio_temp_name"],
-            video_config.config["pause_duration"],
-            video_config.config["background_audio_path"],
-            video_config.config["voice_name"],
-            video_config.config["voice_title_output_name"],
-            video_config.config["voice_text_output_name"],
-            video_config.config["label_name"],
-            video_config.config["font_path"],
-            video_config.config["font_size"],
-            video_config.config["color"],
-            video_config.config["position"],
-            video_config.config["caption_box_width"],
+        render_kwargs = build_render_kwargs(
+            video_config.config,
             max_workers=max_workers,  # Pass the optimal number of workers
-            fast_mode=fast_mode       # Pass fast mode setting
+            fast_mode=fast_mode,      # Pass fast mode setting
+            single_pass=single_pass,  # Pass render mode setting
+            timing_source=timing_source,
+            encode_workers=encode_workers,
+            engine=engine,
+            quality=quality,
+            preview_rendition=preview_rendition,
+            encoder_profile=encoder_profile,
+            video_output_path=video_output_path
         )
-        
-        # Calculate and log the time taken
-        elapsed_time = time.time() - start_time
-        print(f"Video generation completed in {elapsed_time:.2f} seconds")
-        
-        # Clean up again after generation
-        cleanup_temp_files()
+        job_id = jobs.submit(render_kwargs, metadata=metadata)
 
         return jsonify({
-            "message": "Video generated successfully", 
-            "video_output_path": video_config.config["video_output_path"],
-            "generation_time": f"{elapsed_time:.2f} seconds"
-        })
+            "message": "Video generation queued",
+            "job_id": job_id,
+            "status_url": f"/jobs/{job_id}",
+            "video_output_path": video_output_path
+        }), 202
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        # Clean up on error too
-        cleanup_temp_files()
-        app.logger.error(f"Error generating video: {str(e)}")
+        app.logger.error(f"Error queueing video: {str(e)}")
         import traceback
         app.logger.error(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+@app.route('/generate_batch', methods=['POST'])
+def generate_batch():
+    try:
+        data = request.json
+        batch_id, job_ids, failed_items = submit_batch(
+            jobs,
+            data["story_filenames"],
+            data["video_filename"],
+            fast_mode=data.get("fast_mode", True),
+            single_pass=data.get("single_pass", True)
+        )
+        batches[batch_id] = failed_items
+
+        return jsonify({
+            "message": "Batch queued",
+            "batch_id": batch_id,
+            "job_ids": job_ids,
+            "status_url": f"/batches/{batch_id}"
+        }), 202
+    except Exception as e:
+        app.logger.error(f"Error queueing batch: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/batches/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    if batch_id not in batches:
+        return jsonify({"error": f"Batch not found: {batch_id}"}), 404
+    return jsonify(get_batch_report(jobs, batch_id, batches[batch_id]))
+
+@app.route('/jobs', methods=['GET'])
+def get_jobs():
+    return jsonify(jobs.list())
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if not jobs.cancel(job_id):
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+    return jsonify({"message": "Job cancellation requested", "job": jobs.get(job_id)})
+
+@app.route('/jobs/<job_id>/promote', methods=['POST'])
+def promote_job(job_id):
+    """Queue the final render of an approved draft from the same inputs."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+    if job["metadata"].get("quality") != "draft":
+        return jsonify({"error": f"Job {job_id} is not a draft"}), 400
+    # Only a finished draft can have been reviewed and approved
+    if job["status"] != "completed":
+        return jsonify({"error": f"Draft {job_id} is {job['status']}, only a completed draft can be promoted"}), 409
+
+    # Same story text, voice and config, so the voices and timings come from the cache
+    render_kwargs = jobs.get_render_kwargs(job_id)
+    render_kwargs["quality"] = "final"
+    render_kwargs["video_output_path"] = job["metadata"]["final_output_path"]
+    metadata = dict(job["metadata"], quality="final", draft_job_id=job_id)
+    del metadata["final_output_path"]
+    try:
+        final_job_id = jobs.submit(render_kwargs, metadata=metadata)
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+
+    return jsonify({
+        "message": "Final render queued",
+        "job_id": final_job_id,
+        "status_url": f"/jobs/{final_job_id}",
+        "video_output_path": render_kwargs["video_output_path"]
+    }), 202
+
+@app.route('/encoder_profiles', methods=['GET'])
+def get_encoder_profiles():
+    return jsonify(load_encoder_profiles())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(jobs.metrics.to_prometheus(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/get_all_videos', methods=['GET'])
 def get_all_videos():
     videos = []
     for file in os.listdir("output"):
-        videos.append("output/" + file)
+        if is_listed_video(file):
+            videos.append("output/" + file)
     return jsonify(videos)
 
 @app.route('/get_new_stories', methods=['POST'])
@@ -0,0 +1,131 @@
+from video_generator.video import list_background_clips
+from jobs import JobQueue, build_render_kwargs
+
+import argparse
+import json
+import time
+import uuid
+import os
+
+def build_story_render_kwargs(story_filename, video_config, background_clips=None, **options):
+    """Build the generate_video arguments for one story without touching the shared video config file."""
+    with open(os.path.join("story_configs", story_filename), "r", encoding="utf-8") as f:
+        story = json.load(f)
+
+    output_filename = story_filename.split(".")[0] + ".mp4"
+    config = dict(video_config)
+    config["main_text"] = story["content"]
+    config["title_text"] = story["title"]
+    config["video_output_path"] = os.path.join("output", output_filename)
+    return build_render_kwargs(config, background_clips=background_clips, **options)
+
+def submit_batch(job_queue, story_filenames, video_filename, fast_mode=True, single_pass=True):
+    """Queue one render job per story, sharing the video config and background listing between them."""
+    with open(os.path.join("video_configs", video_filename), "r") as f:
+        video_config = json.load(f)
+
+    os.makedirs("output", exist_ok=True)
+    # Scanned once for the whole batch instead of once per render
+    background_clips = list_background_clips(video_config["background_clips_folder"])
+
+    batch_id = uuid.uuid4().hex
+    job_ids = []
+    failed_items = []
+    for story_filename in story_filenames:
+        try:
+            render_kwargs = build_story_render_kwargs(
+                story_filename,
+                video_config,
+                background_clips=background_clips,
+                max_workers=job_queue.threads_per_job(),
+                fast_mode=fast_mode,
+                single_pass=single_pass
+            )
+            job_ids.append(job_queue.submit(render_kwargs, metadata={
+                "batch_id": batch_id,
+                "story_filename": story_filename,
+                "video_filename": video_filename
+            }))
+        except Exception as e:
+            print(f"Couldn't queue {story_filename}: {e}")
+            failed_items.append({"story_filename": story_filename, "status": "failed", "error": str(e)})
+
+    print(f"Queued batch {batch_id} with {len(job_ids)} stories")
+    return batch_id, job_ids, failed_items
+
+def get_batch_report(job_queue, batch_id, failed_items=None):
+    batch_jobs = [job for job in job_queue.list() if job["metadata"].get("batch_id") == batch_id]
+    if not batch_jobs and not failed_items:
+        return None
+
+    items = list(failed_items or [])
+    for job in batch_jobs:
+        items.append({
+            "story_filename": job["metadata"]["story_filename"],
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "stage": job["stage"],
+            "video_output_path": job["video_output_path"],
+            "error": job["error"],
+            "run_time": job["run_time"]
+        })
+
+    completed = sum(1 for item in items if item["status"] == "completed")
+    failed = sum(1 for item in items if item["status"] in ("failed", "cancelled"))
+    pending = len(items) - completed - failed
+
+    elapsed_time = 0
+    if batch_jobs:
+        started_at = min(job["created_at"] for job in batch_jobs)
+        if pending:
+            finished_at = time.time()
+        else:
+            finished_at = max(job["finished_at"] or time.time() for job in batch_jobs)
+        elapsed_time = finished_at - started_at
+    stories_per_hour = completed / elapsed_time * 3600 if elapsed_time > 0 else 0
+
+    return {
+        "batch_id": batch_id,
+        "status": "running" if pending else "finished",
+        "total": len(items),
+        "completed": completed,
+        "failed": failed,
+        "pending": pending,
+        "elapsed_time": round(elapsed_time, 2),
+        "stories_per_hour": round(stories_per_hour, 2),
+        "items": items
+    }
+
+def run_batch(story_filenames, video_filename, workers=None, fast_mode=True, single_pass=True):
+    job_queue = JobQueue(max_workers=workers or max(1, os.cpu_count() // 2))
+    try:
+        batch_id, job_ids, failed_items = submit_batch(
+            job_queue, story_filenames, video_filename, fast_mode=fast_mode, single_pass=single_pass
+        )
+        job_queue.wait(job_ids)
+        return get_batch_report(job_queue, batch_id, failed_items)
+    finally:
+        job_queue.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render many stories against one video config")
+    parser.add_argument("video_filename", help="video config in video_configs/")
+    parser.add_argument("story_filenames", nargs="*", help="stories in story_configs/ (default: all of them)")
+    parser.add_argument("--workers", type=int, default=None, help="number of stories rendered at the same time")
+    parser.add_argument("--two-pass", action="store_true", help="use the two-pass caption render")
+    parser.add_argument("--report", default=None, help="write the batch report to this JSON file")
+    args = parser.parse_args()
+
+    story_filenames = args.story_filenames or sorted(
+        file for file in os.listdir("story_configs") if file.endswith(".json")
+    )
+    report = run_batch(story_filenames, args.video_filename, workers=args.workers, single_pass=not args.two_pass)
+
+    for item in report["items"]:
+        print(f"{item['status']:>10}  {item['story_filename']}  {item.get('video_output_path') or item.get('error')}")
+    print(f"{report['completed']}/{report['total']} stories rendered in {report['elapsed_time']:.2f} seconds "
+          f"({report['stories_per_hour']:.2f} stories per hour)")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,233 @@
+"""A local stand-in for the ElevenLabs and OpenAI HTTP APIs so the pipeline can run without network access."""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from email.parser import BytesParser
+from urllib.parse import urlparse, parse_qs
+import threading
+import subprocess
+import json
+import io
+import os
+import base64
+import hashlib
+import re
+
+import numpy as np
+import imageio_ffmpeg
+
+SAMPLE_RATE = 44100
+TRANSCRIBE_SAMPLE_RATE = 16000
+
+def _seed_for(text):
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+
+def _count_syllables(word):
+    return max(1, len(re.findall(r"[aeiouy]+", word.lower())))
+
+def synthesize_speech(text, sample_rate=SAMPLE_RATE):
+    """Render deterministic speech-like audio for text.
+
+    Every word becomes a voiced burst with one envelope bump per syllable,
+    separated by short silences (longer after punctuation), which gives
+    roughly the pacing of real narration. Returns the mono float32 samples
+    and the word timings.
+    """
+    rng = np.random.default_rng(_seed_for(text))
+    segments = []
+    timings = []
+    position = 0.0
+
+    for word in text.split():
+        syllables = _count_syllables(word)
+        duration = 0.1 + 0.12 * syllables
+        n_samples = int(duration * sample_rate)
+        t = np.arange(n_samples, dtype=np.float32) / sample_rate
+
+        f0 = rng.uniform(100, 180)
+        phase = 2 * np.pi * f0 * t + 2 * np.sin(2 * np.pi * 5 * t)
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+        noise = rng.normal(0, 0.3, n_samples)
+        envelope = np.abs(np.sin(np.pi * syllables * t / duration)) ** 0.7
+        segments.append((0.25 * (voiced / 2 + noise) * envelope).astype(np.float32))
+        timings.append({"word": word, "start": position, "end": position + duration})
+        position += duration
+
+        gap = 0.08 + (0.3 if word[-1] in ".!?" else 0.12 if word[-1] in ",;:" else 0)
+        segments.append(np.zeros(int(gap * sample_rate), dtype=np.float32))
+        position += gap
+
+    if not segments:
+        segments.append(np.zeros(int(0.5 * sample_rate), dtype=np.float32))
+    return np.concatenate(segments), timings
+
+def character_alignment(timings):
+    """Spread each word's time over its characters, the shape ElevenLabs returns."""
+    characters, starts, ends = [], [], []
+    for i, timing in enumerate(timings):
+        if i > 0:
+            characters.append(" ")
+            starts.append(timings[i - 1]["end"])
+            ends.append(timing["start"])
+        step = (timing["end"] - timing["start"]) / len(timing["word"])
+        for j, char in enumerate(timing["word"]):
+            characters.append(char)
+            starts.append(timing["start"] + j * step)
+            ends.append(timing["start"] + (j + 1) * step)
+    return {
+        "characters": characters,
+        "character_start_times_seconds": starts,
+        "character_end_times_seconds": ends
+    }
+
+def encode_mp3(samples, sample_rate=SAMPLE_RATE):
+    result = subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error",
+         "-f", "f32le", "-ar", str(sample_rate), "-ac", "1", "-i", "-",
+         "-f", "mp3", "-b:a", "128k", "-"],
+        input=samples.astype(np.float32).tobytes(),
+        capture_output=True,
+        check=True
+    )
+    return result.stdout
+
+def decode_mono(audio_file, sample_rate=TRANSCRIBE_SAMPLE_RATE):
+    result = subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error",
+         "-i", "-", "-f", "f32le", "-ar", str(sample_rate), "-ac", "1", "-"],
+        input=audio_file.read(),
+        capture_output=True,
+        check=True
+    )
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+def detect_words(samples, sample_rate=TRANSCRIBE_SAMPLE_RATE, frame_duration=0.01, min_gap=0.05, min_word=0.03):
+    """Find the (start, end) of every voiced burst from the frame energy."""
+    frame_length = int(frame_duration * sample_rate)
+    n_frames = len(samples) // frame_length
+    if n_frames == 0:
+        return []
+    frames = samples[:n_frames * frame_length].reshape(n_frames, frame_length)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    voiced = rms > rms.max() * 0.05
+
+    # Indices where voiced runs start and stop
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], voiced.astype(np.int8), [0]))))
+    runs = [[float(start * frame_duration), float(end * frame_duration)] for start, end in zip(edges[::2], edges[1::2])]
+
+    # Syllable dips inside a word are much shorter than the pause between words
+    merged = []
+    for run in runs:
+        if merged and run[0] - merged[-1][1] < min_gap:
+            merged[-1][1] = run[1]
+        else:
+            merged.append(run)
+    return [(start, end) for start, end in merged if end - start >= min_word]
+
+class FakeTextToSpeech:
+    def __init__(self):
+        self.calls = 0
+
+    def convert_with_timestamps(self, text, voice_id=None, model_id=None, output_format="mp3_44100_128", **kwargs):
+        self.calls += 1
+        samples, timings = synthesize_speech(text)
+        return {
+            "audio_base64": base64.b64encode(encode_mp3(samples)).decode("ascii"),
+            "alignment": character_alignment(timings)
+        }
+
+class FakeTranscriptions:
+    def __init__(self):
+        self.calls = 0
+        # Words the harness expects in the audio, in order, used to label the detected bursts
+        self.expected_text = ""
+
+    def create(self, file, model=None, response_format=None, **kwargs):
+        self.calls += 1
+        bursts = detect_words(decode_mono(file))
+        expected_words = [word.strip(".,!?;:\"'()") for word in self.expected_text.split()]
+
+        words = []
+        for i, (start, end) in enumerate(bursts):
+            word = expected_words[i] if i < len(expected_words) else f"word{i}"
+            words.append({"word": word, "start": start, "end": end})
+        return {"words": words, "text": " ".join(word["word"] for word in words)}
+
+def _multipart_fields(content_type, body):
+    message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    return {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+            for part in message.get_payload()}
+
+class StubApiServer:
+    """Serves the two endpoints the pipeline uses on a local port.
+
+    fail_every makes every n-th request answer 429 with Retry-After, to
+    exercise the client's retries.
+    """
+
+    def __init__(self, text_to_speech, transcriptions, fail_every=0, retry_after=0.05):
+        self.text_to_speech = text_to_speech
+        self.transcriptions = transcriptions
+        self.fail_every = fail_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub._lock:
+                    stub.requests += 1
+                    fail = stub.fail_every and stub.requests % stub.fail_every == 0
+                    if fail:
+                        stub.failures += 1
+                if fail:
+                    self._send(429, {"detail": "rate limited"}, {"Retry-After": str(stub.retry_after)})
+                    return
+
+                url = urlparse(self.path)
+                if url.path.startswith("/v1/text-to-speech/") and url.path.endswith("/with-timestamps"):
+                    request = json.loads(body)
+                    output_format = parse_qs(url.query).get("output_format", ["mp3_44100_128"])[0]
+                    self._send(200, stub.text_to_speech.convert_with_timestamps(
+                        request["text"], voice_id=url.path.split("/")[3],
+                        model_id=request.get("model_id"), output_format=output_format))
+                elif url.path == "/v1/audio/transcriptions":
+                    fields = _multipart_fields(self.headers["Content-Type"], body)
+                    self._send(200, stub.transcriptions.create(
+                        io.BytesIO(fields["file"]), model=fields.get("model", b"").decode()))
+                else:
+                    self._send(404, {"detail": "not found"})
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def install_fakes(fail_every=0):
+    """Start a stub API server, point the API clients at it and return the fakes behind it."""
+    text_to_speech = FakeTextToSpeech()
+    transcriptions = FakeTranscriptions()
+    stub = StubApiServer(text_to_speech, transcriptions, fail_every=fail_every)
+    os.environ["ELEVENLABS_BASE_URL"] = stub.base_url
+    os.environ["OPENAI_BASE_URL"] = stub.base_url
+    return text_to_speech, transcriptions
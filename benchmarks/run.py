@@ -0,0 +1,247 @@
+"""End-to-end render benchmark that runs offline against the fakes in benchmarks.fakes.
+
+    python -m benchmarks.run --stories short medium long --max-workers 1 4 --fast-mode on off
+"""
+from datetime import datetime
+import concurrent.futures
+import subprocess
+import itertools
+import platform
+import argparse
+import resource
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+import imageio_ffmpeg
+
+from config import QUALITY_LEVELS
+
+BENCHMARK_DIR = os.path.join("temp", "benchmarks")
+
+# Story lengths in words, roughly 20 seconds, 1.5 minutes and 4 minutes of narration
+STORY_LENGTHS = {
+    "short": 60,
+    "medium": 250,
+    "long": 650
+}
+
+VOCABULARY = (
+    "i was the and then my she he they it we had never so when what about after before home "
+    "night door phone message friend sister brother mother father work car house street window "
+    "really suddenly finally actually because something nothing everyone somebody remember "
+    "strange quiet dark morning evening weekend apartment neighbor manager craigslist ad"
+).split()
+
+def make_story(n_words, seed):
+    rng = random.Random(seed)
+    words = []
+    sentence_length = rng.randint(6, 16)
+    for i in range(n_words):
+        word = rng.choice(VOCABULARY)
+        if sentence_length == 0:
+            words[-1] += "."
+            word = word.capitalize()
+            sentence_length = rng.randint(6, 16)
+        elif rng.random() < 0.05:
+            word += ","
+        words.append(word)
+        sentence_length -= 1
+    return " ".join(words) + "."
+
+def make_background_clips(folder, count=6, duration=10, size="1080x1920", fps=30):
+    """Write synthetic background clips with real motion so decoding costs are realistic."""
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        clip_path = os.path.join(folder, f"background_{i}.mp4")
+        if os.path.exists(clip_path):
+            continue
+        subprocess.run(
+            [imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+             "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={fps}:duration={duration}",
+             "-vf", f"hue=h={i * 60}", "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+             clip_path],
+            check=True
+        )
+        print(f"Created background clip {clip_path}")
+
+def _read_video_frames(video_path):
+    from video_generator.probe import probe
+    info = probe(video_path)
+    return info["duration"], info["fps"], int(round(info["duration"] * info["fps"]))
+
+def _isolate_case(case_dir):
+    """Give the case's process empty caches, API limits and background usage of its own.
+
+    Otherwise only the first case pays for TTS and transcription, the fake
+    audio would land in the caches production renders read from, and the
+    benchmark would take tokens and slots from production renders. Runs as the
+    process initializer, before the pipeline is imported and reads the paths.
+    """
+    if any(module == "video_generator" or module.startswith("video_generator.") for module in sys.modules):
+        raise RuntimeError("The pipeline was imported before the benchmark case was isolated")
+    shutil.rmtree(case_dir, ignore_errors=True)
+    os.environ["VOICE_CACHE_DIR"] = os.path.join(case_dir, "voice_cache")
+    os.environ["TRANSCRIPT_CACHE_DIR"] = os.path.join(case_dir, "transcript_cache")
+    os.environ["BACKGROUND_USAGE_PATH"] = os.path.join(case_dir, "background_usage.json")
+    os.environ["API_STATE_DIR"] = os.path.join(case_dir, "api_limits")
+
+def _run_case(case, background_folder, font_path):
+    # Runs in a fresh process so peak memory belongs to this case only
+    from benchmarks.fakes import install_fakes
+    from video_generator.generator import generate_video
+    from video_generator.metrics import recording
+    from video_generator.voice import split_text
+
+    text_to_speech, transcriptions = install_fakes()
+    title = make_story(12, seed=f"title-{case['story']}")
+    main_text = make_story(STORY_LENGTHS[case["story"]], seed=case["story"])
+    transcriptions.expected_text = f"{title} {main_text}"
+
+    video_output_path = os.path.join(BENCHMARK_DIR, "output", f"{case['name']}.mp4")
+    with recording() as recorder:
+        start_time = time.perf_counter()
+        generate_video(
+            main_text,
+            title,
+            video_output_path,
+            background_clips_folder=background_folder,
+            temp_voices_folder=os.path.join(BENCHMARK_DIR, "voices"),
+            temp_audio_folder=os.path.join(BENCHMARK_DIR, "audio"),
+            font_path=font_path,
+            video_name=case["name"],
+            max_workers=case["max_workers"],
+            fast_mode=case["fast_mode"],
+            single_pass=case["single_pass"],
+            timing_source=case["timing_source"],
+            encode_workers=case["encode_workers"],
+            engine=case["engine"],
+            quality=case["quality"]
+        )
+        wall_time = time.perf_counter() - start_time
+
+    # With empty caches every case makes the same calls, or its stage times aren't comparable
+    expected_tts_calls = len(split_text(title)) + len(split_text(main_text))
+    expected_transcription_calls = 1 if case["timing_source"] == "whisper" else 0
+    assert text_to_speech.calls == expected_tts_calls, \
+        f"{text_to_speech.calls} TTS calls, expected {expected_tts_calls}"
+    assert transcriptions.calls == expected_transcription_calls, \
+        f"{transcriptions.calls} transcription calls, expected {expected_transcription_calls}"
+
+    duration, fps, frames = _read_video_frames(video_output_path)
+    stage_times = {}
+    for stage_span in recorder.to_list():
+        stage_times[stage_span["stage"]] = round(stage_times.get(stage_span["stage"], 0) + stage_span["wall_time"], 3)
+
+    return dict(case,
+        wall_time=round(wall_time, 3),
+        video_duration=round(duration, 2),
+        frames=frames,
+        frames_per_second=round(frames / wall_time, 2),
+        peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        peak_child_rss=resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+        output_size=os.path.getsize(video_output_path),
+        tts_calls=text_to_speech.calls,
+        transcription_calls=transcriptions.calls,
+        stage_times=stage_times
+    )
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_benchmarks(stories, max_workers_options, fast_mode_options, single_pass_options,
+        timing_source_options=("alignment",), encode_workers_options=(1,), engine_options=("moviepy",), quality_options=("final",), repeat=1, background_folder=None, background_size="1080x1920", font_path="assets/fonts/roboto.ttf"):
+    if not background_folder:
+        background_folder = os.path.join(BENCHMARK_DIR, f"backgrounds_{background_size}")
+        make_background_clips(background_folder, size=background_size)
+
+    results = []
+    for story, max_workers, fast_mode, single_pass, timing_source, encode_workers, engine, quality, run in itertools.product(
+            stories, max_workers_options, fast_mode_options, single_pass_options, timing_source_options,
+            encode_workers_options, engine_options, quality_options, range(repeat)):
+        case = {
+            "name": f"{story}_w{max_workers}_{'fast' if fast_mode else 'full'}_{'single' if single_pass else 'two'}_{timing_source}_e{encode_workers}_{engine}_{quality}_{run}",
+            "story": story,
+            "max_workers": max_workers,
+            "fast_mode": fast_mode,
+            "single_pass": single_pass,
+            "timing_source": timing_source,
+            "encode_workers": encode_workers,
+            "engine": engine,
+            "quality": quality,
+            "run": run
+        }
+        print(f"Running benchmark case {case['name']}...")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=_isolate_case,
+                initargs=(os.path.join(BENCHMARK_DIR, "cases", case["name"]),)) as executor:
+            try:
+                result = executor.submit(_run_case, case, background_folder, font_path).result()
+            except Exception as e:
+                print(f"Benchmark case {case['name']} failed: {e}")
+                result = dict(case, error=str(e))
+        results.append(result)
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": _git_commit(),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count()
+        },
+        "results": results
+    }
+
+def _parse_switch(value):
+    return value.lower() in ("on", "true", "1", "yes")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end render benchmark")
+    parser.add_argument("--stories", nargs="+", default=["short", "medium", "long"], choices=list(STORY_LENGTHS))
+    parser.add_argument("--max-workers", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--fast-mode", nargs="+", default=["on"], help="on/off values to try")
+    parser.add_argument("--single-pass", nargs="+", default=["on"], help="on/off values to try")
+    parser.add_argument("--timing-source", nargs="+", default=["alignment"], choices=["alignment", "whisper"])
+    parser.add_argument("--encode-workers", nargs="+", type=int, default=[1], help="time slices encoded side by side")
+    parser.add_argument("--engine", nargs="+", default=["moviepy"], choices=["moviepy", "ffmpeg"])
+    parser.add_argument("--quality", nargs="+", default=["final"], choices=list(QUALITY_LEVELS))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--background-folder", default=None, help="use real clips instead of synthetic ones")
+    parser.add_argument("--background-size", default="1080x1920", help="resolution of the synthetic clips")
+    parser.add_argument("--font-path", default="assets/fonts/roboto.ttf")
+    parser.add_argument("--output", default=None, help="results file (default: temp/benchmarks/results-<time>.json)")
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        args.stories,
+        args.max_workers,
+        [_parse_switch(value) for value in args.fast_mode],
+        [_parse_switch(value) for value in args.single_pass],
+        timing_source_options=args.timing_source,
+        encode_workers_options=args.encode_workers,
+        engine_options=args.engine,
+        quality_options=args.quality,
+        repeat=args.repeat,
+        background_folder=args.background_folder,
+        background_size=args.background_size,
+        font_path=args.font_path
+    )
+
+    output_path = args.output or os.path.join(BENCHMARK_DIR, f"results-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for result in report["results"]:
+        if "error" in result:
+            print(f"{result['name']:<50} failed: {result['error']}")
+        else:
+            print(f"{result['name']:<50} {result['wall_time']:>8.2f}s {result['frames_per_second']:>8.2f} fps "
+                  f"{result['peak_rss'] / 2**20:>8.0f} MB")
+    print(f"Saved benchmark results to {output_path}")
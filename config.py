@@ -11,4 +11,45 @@ VOICE_ID_5 = "21m00Tcm4TlvDq8ikWAM"
 
 VOICES = {
     "default": VOICE_ID_1
-}
\ No newline at end of file
+}
+
+#RENDER QUEUE
+RENDER_WORKERS = 2  # Number of renders that may run at the same time
+MAX_QUEUED_JOBS = 50  # Reject new jobs once this many are waiting or running
+
+#CACHES
+VOICE_CACHE_MAX_BYTES = 2 * 1024**3  # Least recently used voices are dropped above this size
+
+#TEXT TO SPEECH
+TTS_CHUNK_CHARS = 1000  # Long paragraphs are split at sentence boundaries to stay under this
+TTS_MIN_CHUNK_CHARS = 250  # Shorter paragraphs are merged with the next one
+TTS_MAX_CONCURRENCY = 3  # Chunk requests in flight per voice
+
+#API CLIENTS
+ELEVENLABS_BASE_URL = "https://api.elevenlabs.io"
+OPENAI_BASE_URL = "https://api.openai.com"
+
+# Limits are shared by every render worker on the machine. hedge_after (seconds)
+# sends a duplicate request when the first is that slow; it is billed twice, so it is off by default
+API_LIMITS = {
+    "elevenlabs": {"rate_per_second": 2, "burst": 4, "max_concurrency": 4, "timeout": 120, "max_retries": 4, "hedge_after": None},
+    "openai": {"rate_per_second": 1, "burst": 3, "max_concurrency": 2, "timeout": 300, "max_retries": 4, "hedge_after": None}
+}
+
+#BACKGROUNDS
+# Seconds a background segment given to one render is avoided by the next ones
+BACKGROUND_REUSE_WINDOW = 6 * 3600
+
+#RENDER QUALITY
+# "final" is what gets published. "draft" previews a story or video config at a
+# fraction of the cost: backgrounds decoded, and label and captions drawn, at scale
+QUALITY_LEVELS = {
+    "final": {"scale": 1, "fps": 30, "preset": "ultrafast", "crf": 28},
+    "draft": {"scale": 0.25, "fps": 15, "preset": "ultrafast", "crf": 32}
+}
+
+# Lower bitrate copy written as <video>_preview.mp4 when a render asks for one
+PREVIEW_RENDITION = {"height": 640, "video_bitrate": "800k", "audio_bitrate": "96k"}
+
+# Named encoder settings measured on this host, written by tune_encoder.py
+ENCODER_PROFILES_PATH = "encoder_profiles.json"
@@ -0,0 +1,142 @@
+"""Slice long source videos into background clips in one uniform mezzanine format.
+
+Every segment is cut and re-encoded by its own ffmpeg process, in parallel,
+to a fixed vertical resolution, frame rate and a short GOP without audio,
+so renders decode every background the same cheap way. Sources are
+recognised by a hash of their content and skipped once ingested.
+
+    python ingest.py mc_parkour.mp4 --output-folder assets/backgrounds/minecraft/parkour1/
+"""
+from video_generator.backgrounds import BackgroundIndex, BACKGROUND_INDEX_DIR, locked_json
+from video_generator.probe import probe_duration
+
+import concurrent.futures
+import multiprocessing
+import subprocess
+import argparse
+import hashlib
+import time
+import os
+
+import imageio_ffmpeg
+
+# Source hash -> what it was sliced into, shared by every background folder
+INGEST_MANIFEST_PATH = os.path.join(BACKGROUND_INDEX_DIR, "ingested.json")
+
+MEZZANINE = {
+    "width": 1080,
+    "height": 1920,
+    "fps": 30,
+    # One keyframe a second, so any cut point is at most a second of decoding away
+    "gop": 30,
+    "crf": 20,
+    "preset": "veryfast"
+}
+
+def file_digest(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def plan_slices(duration, segment_seconds, min_segment_seconds):
+    slices = []
+    start = 0
+    while start < duration:
+        length = min(segment_seconds, duration - start)
+        if length >= min_segment_seconds:
+            slices.append((start, length))
+        start += segment_seconds
+    return slices
+
+def encode_slice(source_path, start, length, output_path, mezzanine=MEZZANINE, threads=1):
+    """Cut one segment of the source and encode it to the mezzanine format."""
+    width, height = mezzanine["width"], mezzanine["height"]
+    # Fill the frame and crop the overflow, landscape sources lose their sides
+    video_filter = (f"scale={width}:{height}:force_original_aspect_ratio=increase,"
+                    f"crop={width}:{height},setsar=1,fps={mezzanine['fps']}")
+    # Written under a hidden name so the index never picks up a partial file
+    temp_path = os.path.join(os.path.dirname(output_path), f".{os.path.basename(output_path)}")
+    subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-y",
+         "-ss", str(start), "-t", str(length), "-i", source_path,
+         "-an", "-vf", video_filter,
+         "-c:v", "libx264", "-preset", mezzanine["preset"], "-crf", str(mezzanine["crf"]),
+         "-g", str(mezzanine["gop"]), "-keyint_min", str(mezzanine["gop"]), "-sc_threshold", "0",
+         "-pix_fmt", "yuv420p", "-threads", str(threads), "-movflags", "+faststart",
+         "-f", "mp4", temp_path],
+        check=True
+    )
+    os.replace(temp_path, output_path)
+    return output_path
+
+def ingest(source_paths, output_folder, segment_seconds=10, min_segment_seconds=2, max_workers=None, mezzanine=MEZZANINE, force=False):
+    """Slice every source that isn't ingested yet and refresh the output folder's index."""
+    os.makedirs(output_folder, exist_ok=True)
+    max_workers = max_workers or multiprocessing.cpu_count()
+    settings = dict(mezzanine, segment_seconds=segment_seconds)
+
+    jobs = []
+    sources = []
+    for source_path in source_paths:
+        print(f"Hashing {source_path}")
+        digest = file_digest(source_path)
+        with locked_json(INGEST_MANIFEST_PATH) as manifest:
+            entry = manifest.get(digest)
+        if not force and entry and entry["settings"] == settings and all(os.path.exists(path) for path in entry["outputs"]):
+            print(f"Skipping {source_path}, already ingested as {len(entry['outputs'])} clips")
+            continue
+
+        if entry:
+            # Settings changed or clips went missing: the old clips of this source are replaced, not left behind
+            for old_path in entry["outputs"]:
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+
+        # The digest keeps sources that share a file name from overwriting each other's clips
+        stem = f"{os.path.splitext(os.path.basename(source_path))[0]}_{digest[:8]}"
+        outputs = []
+        for i, (start, length) in enumerate(plan_slices(probe_duration(source_path), segment_seconds, min_segment_seconds)):
+            output_path = os.path.join(output_folder, f"{stem}_{i:04d}.mp4")
+            outputs.append(output_path)
+            jobs.append((source_path, start, length, output_path))
+        sources.append((source_path, digest, outputs))
+
+    if jobs:
+        # Slices run side by side, so each ffmpeg gets an even share of the cores
+        threads = max(1, multiprocessing.cpu_count() // max_workers)
+        print(f"Encoding {len(jobs)} slices with {max_workers} workers")
+        start_time = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(encode_slice, *job, mezzanine=mezzanine, threads=threads) for job in jobs]
+            for future in concurrent.futures.as_completed(futures):
+                print(f"Wrote {future.result()}")
+        print(f"Encoded {len(jobs)} slices in {time.time() - start_time:.2f} seconds")
+
+    with locked_json(INGEST_MANIFEST_PATH) as manifest:
+        for source_path, digest, outputs in sources:
+            manifest[digest] = {"source": os.path.abspath(source_path), "outputs": outputs, "settings": settings, "ingested_at": time.time()}
+
+    return BackgroundIndex(output_folder).refresh()
+
+def main():
+    parser = argparse.ArgumentParser(description="Slice source videos into background clips")
+    parser.add_argument("sources", nargs="+")
+    parser.add_argument("--output-folder", default="assets/backgrounds/minecraft/parkour1/")
+    parser.add_argument("--segment-seconds", type=float, default=10)
+    parser.add_argument("--min-segment-seconds", type=float, default=2)
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--width", type=int, default=MEZZANINE["width"])
+    parser.add_argument("--height", type=int, default=MEZZANINE["height"])
+    parser.add_argument("--fps", type=int, default=MEZZANINE["fps"])
+    parser.add_argument("--force", action="store_true", help="ingest sources again even if they were ingested before")
+    args = parser.parse_args()
+
+    mezzanine = dict(MEZZANINE, width=args.width, height=args.height, fps=args.fps, gop=args.fps)
+    clips = ingest(args.sources, args.output_folder, args.segment_seconds, args.min_segment_seconds,
+                   args.max_workers, mezzanine, args.force)
+    print(f"{len(clips)} clips in {args.output_folder}")
+
+if __name__ == "__main__":
+    main()
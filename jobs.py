@@ -0,0 +1,234 @@
+from video_generator.generator import generate_video
+from video_generator.label import preload_label_assets
+from video_generator.metrics import MetricsRegistry, recording
+from video_generator.workspace import Workspace
+
+from config import RENDER_WORKERS, MAX_QUEUED_JOBS
+
+import concurrent.futures
+import multiprocessing
+import threading
+import traceback
+import tempfile
+import time
+import uuid
+import os
+
+# Video config keys that map directly onto generate_video arguments
+RENDER_CONFIG_KEYS = [
+    "main_text", "title_text", "video_output_path", "background_clips_folder",
+    "temp_voices_folder", "temp_audio_folder", "capitalize", "audio_temp_name",
+    "pause_duration", "background_audio_path", "voice_name", "voice_title_output_name",
+    "voice_text_output_name", "label_name", "font_path", "font_size", "color",
+    "position", "caption_box_width"
+]
+
+class JobCancelled(Exception):
+    pass
+
+class QueueFull(Exception):
+    pass
+
+def build_render_kwargs(video_config, **options):
+    render_kwargs = {key: video_config[key] for key in RENDER_CONFIG_KEYS}
+    render_kwargs.update(options)
+    return render_kwargs
+
+def _init_worker():
+    # Runs once per worker process so every job it picks up reuses the loaded label assets
+    try:
+        preload_label_assets()
+    except Exception as e:
+        print(f"Couldn't preload label assets: {e}")
+
+def _run_job(job_id, render_kwargs, progress):
+    """Render one video inside a worker process, reporting progress through a shared dict."""
+    progress["started_at"] = time.time()
+
+    def on_stage(stage):
+        if progress.get("cancel_requested"):
+            raise JobCancelled(f"Job cancelled before stage {stage}")
+
+        now = time.time()
+        stages = progress.get("stages", [])
+        if stages:
+            stages[-1]["finished_at"] = now
+            stages[-1]["duration"] = round(now - stages[-1]["started_at"], 2)
+        stages.append({"stage": stage, "started_at": now})
+        # Manager dicts only see reassignments, not in-place mutation
+        progress["stages"] = stages
+        progress["stage"] = stage
+
+    # A worker runs one job at a time, so the process-wide temp directory
+    # can point at this job's workspace
+    workspace = Workspace(job_id)
+    os.environ['MOVIEPY_TEMP_DIR'] = workspace.path
+    os.environ['TMPDIR'] = workspace.path
+    tempfile.tempdir = workspace.path
+
+    try:
+        with recording() as recorder:
+            try:
+                video_output_path = generate_video(
+                    **render_kwargs,
+                    progress_callback=on_stage,
+                    workspace=workspace
+                )
+            finally:
+                progress["spans"] = recorder.to_list()
+    finally:
+        workspace.cleanup()
+        tempfile.tempdir = None
+
+    stages = progress.get("stages", [])
+    if stages:
+        now = time.time()
+        stages[-1]["finished_at"] = now
+        stages[-1]["duration"] = round(now - stages[-1]["started_at"], 2)
+        progress["stages"] = stages
+    progress["stage"] = "done"
+    return video_output_path
+
+class JobQueue:
+    def __init__(self, max_workers=RENDER_WORKERS, max_queued_jobs=MAX_QUEUED_JOBS):
+        self.max_workers = max_workers
+        self.max_queued_jobs = max_queued_jobs
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._manager = None
+        self._executor = None
+        self.metrics = MetricsRegistry()
+
+    def _start(self):
+        # Started lazily so importing the module doesn't spawn processes
+        if self._executor is None:
+            self._manager = multiprocessing.Manager()
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_worker
+            )
+            print(f"Started render queue with {self.max_workers} workers")
+
+    def threads_per_job(self):
+        # Split the CPUs between the renders that may run at the same time
+        cpu_count = multiprocessing.cpu_count()
+        return max(1, min(cpu_count // self.max_workers, 8))
+
+    def _active_jobs(self):
+        return [job for job in self._jobs.values() if not job["future"].done()]
+
+    def submit(self, render_kwargs, metadata=None):
+        with self._lock:
+            self._start()
+            if len(self._active_jobs()) >= self.max_queued_jobs:
+                raise QueueFull(f"Render queue is full ({self.max_queued_jobs} jobs)")
+
+            job_id = uuid.uuid4().hex
+            progress = self._manager.dict({"stage": "queued", "stages": [], "cancel_requested": False})
+            future = self._executor.submit(_run_job, job_id, render_kwargs, progress)
+            self._jobs[job_id] = {
+                "id": job_id,
+                "created_at": time.time(),
+                "finished_at": None,
+                "metadata": metadata or {},
+                # Kept so a draft can be rendered again at final quality
+                "render_kwargs": render_kwargs,
+                "progress": progress,
+                "future": future
+            }
+            future.add_done_callback(lambda _: self._mark_finished(job_id))
+
+        print(f"Queued render job {job_id}")
+        return job_id
+
+    def _mark_finished(self, job_id):
+        job = self._jobs[job_id]
+        job["finished_at"] = time.time()
+        try:
+            spans = job["progress"].get("spans", [])
+        except Exception:
+            # The manager may already be gone while shutting down
+            spans = []
+        self.metrics.observe_job(self._get_status(job), spans)
+
+    def _get_status(self, job):
+        future = job["future"]
+        progress = job["progress"]
+        if future.cancelled():
+            return "cancelled"
+        if future.done():
+            error = future.exception()
+            if error is None:
+                return "completed"
+            if isinstance(error, JobCancelled):
+                return "cancelled"
+            return "failed"
+        if progress.get("cancel_requested"):
+            return "cancelling"
+        if progress.get("started_at"):
+            return "running"
+        return "queued"
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+
+        future = job["future"]
+        progress = job["progress"]
+        status = self._get_status(job)
+        started_at = progress.get("started_at")
+        finished_at = job["finished_at"]
+
+        result = {
+            "job_id": job_id,
+            "status": status,
+            "stage": progress.get("stage"),
+            "stages": progress.get("stages", []),
+            "breakdown": progress.get("spans", []),
+            "metadata": job["metadata"],
+            "created_at": job["created_at"],
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "queue_time": round((started_at or finished_at or time.time()) - job["created_at"], 2),
+            "run_time": round((finished_at or time.time()) - started_at, 2) if started_at else None,
+            "video_output_path": None,
+            "error": None
+        }
+        if status == "completed":
+            result["video_output_path"] = future.result()
+        elif status == "failed":
+            error = future.exception()
+            result["error"] = str(error)
+            result["traceback"] = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+        return result
+
+    def get_render_kwargs(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        return dict(job["render_kwargs"])
+
+    def list(self):
+        return [self.get(job_id) for job_id in list(self._jobs)]
+
+    def wait(self, job_ids):
+        futures = [self._jobs[job_id]["future"] for job_id in job_ids]
+        concurrent.futures.wait(futures)
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+
+        # Jobs still waiting for a worker are dropped right away,
+        # running jobs stop at the start of their next stage
+        if not job["future"].cancel() and not job["future"].done():
+            job["progress"]["cancel_requested"] = True
+        print(f"Cancellation requested for job {job_id}")
+        return True
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
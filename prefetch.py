@@ -0,0 +1,174 @@
+from video_generator.voice import split_text, synthesize_chunks, resolve_voice_name, VOICE_MODEL_ID, VOICE_OUTPUT_FORMAT
+from video_generator.voice_cache import voice_cache
+
+from config import VOICES
+
+import concurrent.futures
+import threading
+import shutil
+import json
+import time
+import uuid
+import os
+
+# Scratch space for prefetched voices, they only need to end up in the voice cache
+PREFETCH_DIR = "temp/prefetch"
+
+class VoicePrefetcher:
+    """Synthesizes the voices of new stories into the voice cache ahead of their render.
+
+    A story is split into the same chunks a render would use, so the render
+    finds every chunk in the cache and starts straight at audio assembly.
+    Stories are prefetched one at a time with up to max_concurrency chunk
+    requests in flight, and characters sent to the TTS are capped per rolling
+    budget_window seconds.
+    """
+
+    def __init__(self, voice_name="random", max_concurrency=1, char_budget=100000, budget_window=86400, folder=PREFETCH_DIR):
+        self.voice_name = voice_name
+        self.char_budget = char_budget
+        self.budget_window = budget_window
+        self.folder = folder
+        # The chunks of a story already use max_concurrency requests
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.max_concurrency = max_concurrency
+
+        self._lock = threading.Lock()
+        self._pending = set()
+        # (time, characters) of every prefetch inside the budget window
+        self._spent = []
+        self.prefetched = 0
+        self.skipped = 0
+        self._schedule_thread = None
+
+    def _chunks(self, title, content):
+        voice_name = resolve_voice_name(self.voice_name, content)
+        voice_id = VOICES[voice_name]
+        chunks = [("title", split_text(title)), ("text", split_text(content))]
+        return voice_id, chunks
+
+    def _uncached_chars(self, voice_id, chunks):
+        total = 0
+        for _, texts in chunks:
+            for text in texts:
+                if not voice_cache.contains(voice_cache.key(text, voice_id, VOICE_MODEL_ID, VOICE_OUTPUT_FORMAT)):
+                    total += len(text)
+        return total
+
+    def _within_budget(self, characters):
+        # Called with the lock held
+        cutoff = time.time() - self.budget_window
+        self._spent = [(spent_at, spent) for spent_at, spent in self._spent if spent_at > cutoff]
+        return sum(spent for _, spent in self._spent) + characters <= self.char_budget
+
+    def submit(self, title, content, name=None):
+        """Queue a story for prefetching, returning False if it is already cached, queued or over budget."""
+        name = name or title
+        voice_id, chunks = self._chunks(title, content)
+        characters = self._uncached_chars(voice_id, chunks)
+        with self._lock:
+            if characters == 0 or name in self._pending:
+                self.skipped += 1
+                return False
+            if not self._within_budget(characters):
+                self.skipped += 1
+                print(f"Prefetch budget of {self.char_budget} characters reached, skipping {name}")
+                return False
+            spent = (time.time(), characters)
+            self._spent.append(spent)
+            self._pending.add(name)
+
+        self.executor.submit(self._prefetch, name, voice_id, chunks, spent)
+        print(f"Queued voice prefetch for {name} ({characters} characters)")
+        return True
+
+    def submit_story_file(self, story_path):
+        with open(story_path, "r", encoding="utf-8") as f:
+            story = json.load(f)
+        return self.submit(story["title"], story["content"], name=os.path.basename(story_path))
+
+    def _prefetch(self, name, voice_id, chunks, spent):
+        folder = os.path.join(self.folder, uuid.uuid4().hex)
+        os.makedirs(folder, exist_ok=True)
+        start_time = time.time()
+        try:
+            for stem, texts in chunks:
+                # synthesize_chunks puts every chunk in the cache as it goes
+                for _ in synthesize_chunks(texts, voice_id, folder, stem=stem,
+                                           max_concurrency=self.max_concurrency, span_name="tts_prefetch"):
+                    pass
+            with self._lock:
+                self.prefetched += 1
+            print(f"Prefetched voices for {name} in {time.time() - start_time:.2f} seconds")
+        except Exception as e:
+            print(f"Voice prefetch failed for {name}: {e}")
+            self._refund(spent, voice_id, chunks)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+            with self._lock:
+                self._pending.discard(name)
+
+    def _refund(self, spent, voice_id, chunks):
+        # Only the chunks that made it into the cache count against the budget
+        unspent = self._uncached_chars(voice_id, chunks)
+        with self._lock:
+            if spent in self._spent:
+                self._spent.remove(spent)
+                if spent[1] > unspent:
+                    self._spent.append((spent[0], spent[1] - unspent))
+
+    def prefetch_pending(self, stories_folder="story_configs", output_folder="output"):
+        """Queue every story that has no rendered video yet."""
+        queued = 0
+        for file in sorted(os.listdir(stories_folder)):
+            if not file.endswith(".json"):
+                continue
+            output_path = os.path.join(output_folder, file.split(".")[0] + ".mp4")
+            if os.path.exists(output_path):
+                continue
+            try:
+                queued += self.submit_story_file(os.path.join(stories_folder, file))
+            except Exception as e:
+                print(f"Couldn't prefetch {file}: {e}")
+        return queued
+
+    def start_schedule(self, interval, stories_folder="story_configs", output_folder="output"):
+        """Scan for un-rendered stories every interval seconds on a daemon thread."""
+        if self._schedule_thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.prefetch_pending(stories_folder, output_folder)
+                except Exception as e:
+                    print(f"Scheduled prefetch failed: {e}")
+                time.sleep(interval)
+
+        self._schedule_thread = threading.Thread(target=loop, daemon=True)
+        self._schedule_thread.start()
+
+    def stats(self):
+        with self._lock:
+            cutoff = time.time() - self.budget_window
+            return {
+                "prefetched": self.prefetched,
+                "skipped": self.skipped,
+                "pending": len(self._pending),
+                "budget_used": sum(spent for spent_at, spent in self._spent if spent_at > cutoff),
+                "char_budget": self.char_budget
+            }
+
+def prefetcher_from_config(config):
+    """Build the prefetcher described by the "prefetch" section of reddit_config.json, or None when it is off."""
+    settings = config.get("prefetch", {})
+    if not settings.get("enabled"):
+        return None
+    prefetcher = VoicePrefetcher(
+        voice_name=settings.get("voice_name", "random"),
+        max_concurrency=settings.get("max_concurrency", 1),
+        char_budget=settings.get("daily_character_budget", 100000)
+    )
+    if settings.get("scan_interval"):
+        prefetcher.start_schedule(settings["scan_interval"], stories_folder=config.get("storage", {}).get("base_dir", "story_configs"))
+    return prefetcher
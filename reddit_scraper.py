@@ -18,6 +18,7 @@ class RedditScraper:
         })
         self._setup_logging()
         self._setup_directories()
+        self._setup_prefetch()
 
     def _setup_logging(self):
         """Setup logging for the RedditScraper"""
@@ -37,6 +38,15 @@ class RedditScraper:
         self.base_dir = Path('story_configs')
         self.base_dir.mkdir(exist_ok=True)
 
+    def _setup_prefetch(self):
+        """Start synthesizing voices for saved stories if prefetch is enabled in the config"""
+        self.prefetcher = None
+        if self.config.get('prefetch', {}).get('enabled'):
+            # Imported here so the scraper doesn't load the video pipeline when prefetch is off
+            from prefetch import prefetcher_from_config
+            self.prefetcher = prefetcher_from_config(self.config)
+            self.logger.info("Voice prefetch enabled")
+
     def _save_post_data(self, post_data: Dict[str, Any], i: int) -> bool:
         """
         Save post data to both JSON file and database
@@ -56,6 +66,12 @@ class RedditScraper:
             json.dump(post_data, f, indent=2, ensure_ascii=False)
 
         self.logger.info(f"Saved new post: {post_data['title']}")
+
+        if self.prefetcher is not None:
+            try:
+                self.prefetcher.submit(post_data['title'], post_data['content'], name=filename)
+            except Exception as e:
+                self.logger.error(f"Couldn't queue voice prefetch for {filename}: {e}")
         return True
 
     def _load_config(self, config_path: str) -> Dict[str, Any]:
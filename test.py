@@ -1,6 +1,18 @@
 import requests
+import time
 
 response = requests.post("http://localhost:5000/generate_video", 
     json={"story_filename": "0_2025-01-21-04-21-.json", "video_filename": "video1.json"})
 
-print(response.content)
\ No newline at end of file
+print(response.content)
+
+# Poll the render job until it finishes
+job_id = response.json()["job_id"]
+while True:
+    job = requests.get(f"http://localhost:5000/jobs/{job_id}").json()
+    print(job["status"], job["stage"])
+    if job["status"] in ("completed", "failed", "cancelled"):
+        break
+    time.sleep(5)
+
+print(job)
@@ -0,0 +1,212 @@
+"""Measure x264 settings on this host and write named encoder profiles.
+
+A sample timeline is cut from the background clips, with a label and
+captions on it like a render, and encoded losslessly once as the reference.
+The reference is decoded to raw frames once, so every combination of
+preset, CRF, thread count, tune and GOP size times only its own encode,
+then it is scored by file size and PSNR/SSIM against the reference. Among
+the settings above the quality floor, the fastest, the smallest that still
+encodes in real time and the smallest at no less than half the fastest
+speed become the "fast", "small" and "balanced" profiles. Renders pick one
+with encoder_profile.
+
+    python tune_encoder.py --background-folder assets/backgrounds/minecraft/parkour1/ --seconds 10
+"""
+from video_generator.backgrounds import BackgroundIndex, plan_segments
+from video_generator.timeline import Timeline
+from video_generator.raw_engine import render_timeline
+from video_generator.label import label_renderer
+from video_generator.caption_renderer import caption_renderer
+from video_generator.overlay import Overlay, IntervalOverlay, resolve_position
+from video_generator.encoder_profiles import PROFILE_KEYS
+
+from config import ENCODER_PROFILES_PATH
+
+from datetime import datetime
+import multiprocessing
+import subprocess
+import itertools
+import argparse
+import platform
+import random
+import json
+import time
+import re
+import os
+
+import imageio_ffmpeg
+
+TUNE_DIR = os.path.join("temp", "encoder_tuning")
+
+SAMPLE_WORDS = (
+    "i never thought my neighbor would knock on the door at night and ask "
+    "about the car parked outside my sister's apartment"
+).split()
+
+def build_sample_timeline(background_folder, seconds, font_path, seed=0):
+    """A timeline composited like a render: backgrounds, the label and a caption every half second."""
+    rng = random.Random(seed)
+    clips = BackgroundIndex(background_folder).refresh()
+    segments = plan_segments(clips, seconds, rng=rng)
+    first_clip = next(clip_info for clip_info in clips if clip_info["path"] == segments[0]["path"])
+    size = (first_clip["width"], first_clip["height"])
+
+    label = {"image": label_renderer.render("What would you do if your neighbor did this?"), "duration": min(3, seconds)}
+    caption_layer = None
+    if font_path and os.path.exists(font_path):
+        box_size = (int(size[0] * 0.8), 50)
+        position = resolve_position(("center", 0.85), size, box_size)
+        overlays = []
+        for i in range(int(seconds * 2)):
+            text = " ".join(rng.choice(SAMPLE_WORDS) for _ in range(3))
+            bitmap = caption_renderer.render(text, font_path, 36, "white", None, box_size)
+            overlays.append(Overlay(bitmap, i / 2, (i + 1) / 2, position))
+        caption_layer = IntervalOverlay(overlays)
+    else:
+        print(f"Font {font_path} not found, the sample has no captions")
+    return Timeline(segments, label=label, caption_layer=caption_layer, size=size)
+
+def decode_reference(reference_path, raw_path):
+    """Decode the reference to raw yuv420p frames, the input every candidate encodes from."""
+    subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-y", "-i", reference_path,
+                    "-an", "-f", "rawvideo", "-pix_fmt", "yuv420p", raw_path], check=True)
+    return raw_path
+
+def encode_candidate(raw_path, size, candidate, output_path, fps):
+    gop = int(round(candidate["gop_seconds"] * fps))
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-y",
+               "-f", "rawvideo", "-pix_fmt", "yuv420p", "-s", f"{size[0]}x{size[1]}", "-r", str(fps), "-i", raw_path,
+               "-c:v", "libx264", "-preset", candidate["preset"], "-crf", str(candidate["crf"]),
+               "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+               "-threads", str(candidate["threads"]), "-pix_fmt", "yuv420p"]
+    if candidate["tune"]:
+        command += ["-tune", candidate["tune"]]
+    start_time = time.perf_counter()
+    subprocess.run(command + [output_path], check=True)
+    return time.perf_counter() - start_time
+
+def measure_quality(video_path, reference_path):
+    """(PSNR in dB, SSIM) of the video against the reference."""
+    result = subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-i", video_path, "-i", reference_path,
+         "-lavfi", "[0:v]split[a][b];[1:v]split[c][d];[a][c]psnr;[b][d]ssim", "-f", "null", "-"],
+        capture_output=True, text=True, check=True
+    )
+    psnr = re.search(r"PSNR .*average:(\S+)", result.stderr).group(1)
+    ssim = re.search(r"SSIM .*All:(\S+)", result.stderr).group(1)
+    # Identical frames give an infinite PSNR, which JSON can't hold
+    return min(float(psnr), 100.0), float(ssim)
+
+def pick_profiles(results, min_psnr, min_fps):
+    passing = [result for result in results if result["psnr"] >= min_psnr]
+    if not passing:
+        print(f"No setting reached {min_psnr} dB, picking from all of them")
+        passing = results
+
+    fast = max(passing, key=lambda result: result["encode_fps"])
+    realtime = [result for result in passing if result["encode_fps"] >= min_fps] or [fast]
+    small = min(realtime, key=lambda result: result["size"])
+    balanced = min((result for result in passing if result["encode_fps"] >= fast["encode_fps"] / 2),
+                   key=lambda result: result["size"])
+
+    def profile(result):
+        return dict({key: result[key] for key in PROFILE_KEYS},
+                    measured={key: result[key] for key in ("encode_fps", "size", "psnr", "ssim")})
+    return {"fast": profile(fast), "balanced": profile(balanced), "small": profile(small)}
+
+def tune(background_folder, seconds=10, fps=30, presets=("ultrafast", "superfast", "veryfast", "faster"),
+        crfs=(23, 28), threads_options=None, tunes=(None, "fastdecode"), gop_seconds_options=(1, 2),
+        min_psnr=35, min_fps=None, font_path="assets/fonts/roboto.ttf", output_path=ENCODER_PROFILES_PATH):
+    """Run the whole matrix and write the profiles to output_path."""
+    cpu_count = multiprocessing.cpu_count()
+    threads_options = threads_options or sorted({1, max(1, cpu_count // 2), cpu_count})
+    os.makedirs(TUNE_DIR, exist_ok=True)
+
+    timeline = build_sample_timeline(background_folder, seconds, font_path)
+    frames = int(timeline.duration * fps)
+    reference_path = os.path.join(TUNE_DIR, "reference.mp4")
+    raw_path = os.path.join(TUNE_DIR, "reference.yuv")
+    candidate_path = os.path.join(TUNE_DIR, "candidate.mp4")
+    results = []
+    try:
+        print(f"Rendering a {seconds} second {timeline.size[0]}x{timeline.size[1]} lossless reference")
+        render_timeline(timeline, reference_path, fps, preset="ultrafast", ffmpeg_params=("-qp", "0"))
+        decode_reference(reference_path, raw_path)
+
+        candidates = [
+            {"preset": preset, "crf": crf, "threads": threads, "tune": tune_flag, "gop_seconds": gop_seconds}
+            for preset, crf, threads, tune_flag, gop_seconds
+            in itertools.product(presets, crfs, threads_options, tunes, gop_seconds_options)
+        ]
+        print(f"Encoding {len(candidates)} candidate settings")
+        for candidate in candidates:
+            name = f"{candidate['preset']}_crf{candidate['crf']}_t{candidate['threads']}_{candidate['tune'] or 'none'}_g{candidate['gop_seconds']}"
+            try:
+                wall_time = encode_candidate(raw_path, timeline.size, candidate, candidate_path, fps)
+                psnr, ssim = measure_quality(candidate_path, reference_path)
+            except subprocess.CalledProcessError as e:
+                print(f"{name:<44} failed: {e}")
+                continue
+            result = dict(candidate,
+                name=name,
+                encode_fps=round(frames / wall_time, 2),
+                size=os.path.getsize(candidate_path),
+                psnr=round(psnr, 3),
+                ssim=round(ssim, 5)
+            )
+            results.append(result)
+            print(f"{name:<44} {result['encode_fps']:>8.2f} fps {result['size'] / 2**20:>8.2f} MB "
+                  f"{result['psnr']:>7.2f} dB {result['ssim']:>8.5f}")
+    finally:
+        # Whichever of them a failed step never wrote is missing
+        for path in (candidate_path, raw_path, reference_path):
+            if os.path.exists(path):
+                os.remove(path)
+    if not results:
+        raise RuntimeError("Every candidate encode failed")
+
+    profiles = pick_profiles(results, min_psnr, min_fps or fps)
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "host": {
+            "platform": platform.platform(),
+            "cpu_count": cpu_count
+        },
+        "sample": {"background_folder": background_folder, "seconds": seconds, "size": list(timeline.size), "fps": fps},
+        "min_psnr": min_psnr,
+        "profiles": profiles,
+        "results": results
+    }
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    for name, profile in profiles.items():
+        print(f"{name:<10} {profile['preset']} crf {profile['crf']}, {profile['threads']} threads, "
+              f"tune {profile['tune'] or 'none'}, GOP {profile['gop_seconds']}s: {profile['measured']}")
+    print(f"Saved encoder profiles to {output_path}")
+    return profiles
+
+def _parse_tune(value):
+    return None if value == "none" else value
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark x264 settings on this host and write encoder profiles")
+    parser.add_argument("--background-folder", default="assets/backgrounds/minecraft/parkour1/")
+    parser.add_argument("--seconds", type=float, default=10, help="length of the sample timeline")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--presets", nargs="+", default=["ultrafast", "superfast", "veryfast", "faster"])
+    parser.add_argument("--crf", nargs="+", type=int, default=[23, 28])
+    parser.add_argument("--threads", nargs="+", type=int, default=None, help="default: 1, half and all of the CPUs")
+    parser.add_argument("--tune", nargs="+", default=["none", "fastdecode"], help="x264 -tune values, none for no tune")
+    parser.add_argument("--gop-seconds", nargs="+", type=float, default=[1, 2])
+    parser.add_argument("--min-psnr", type=float, default=35, help="quality floor every profile has to reach")
+    parser.add_argument("--min-fps", type=float, default=None, help="speed the small profile has to reach (default: --fps)")
+    parser.add_argument("--font-path", default="assets/fonts/roboto.ttf")
+    parser.add_argument("--output", default=ENCODER_PROFILES_PATH)
+    args = parser.parse_args()
+
+    tune(args.background_folder, args.seconds, args.fps, args.presets, args.crf, args.threads,
+         [_parse_tune(value) for value in args.tune], args.gop_seconds, args.min_psnr, args.min_fps,
+         args.font_path, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+from contextlib import contextmanager
+import concurrent.futures
+import threading
+import random
+import fcntl
+import json
+import time
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import API_LIMITS, ELEVENLABS_API_KEY, ELEVENLABS_BASE_URL, OPENAI_API_KEY, OPENAI_BASE_URL
+from video_generator.metrics import span
+
+# Token buckets and concurrency slots live here so every worker process shares them
+API_STATE_DIR = os.environ.get("API_STATE_DIR", "temp/api_limits")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class ApiError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class TokenBucket:
+    """A rate limit shared by every process through a flock-protected state file."""
+
+    def __init__(self, path, rate_per_second, burst):
+        self.path = path
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+
+    def acquire(self):
+        while True:
+            wait = self._try_take()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _try_take(self):
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                now = time.time()
+                tokens = state.get("tokens", self.burst)
+                tokens = min(self.burst, tokens + (now - state.get("updated", now)) * self.rate_per_second)
+                wait = 0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / self.rate_per_second
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({"tokens": tokens, "updated": now}))
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+class ConcurrencySlots:
+    """At most max_concurrency holders across processes, one lock file per slot.
+
+    A slot held by a process that dies is released by the kernel with its lock.
+    """
+
+    def __init__(self, prefix, max_concurrency, poll_interval=0.05):
+        self.paths = [f"{prefix}.slot{i}" for i in range(max_concurrency)]
+        self.poll_interval = poll_interval
+
+    @contextmanager
+    def hold(self):
+        slot = self._acquire()
+        try:
+            yield
+        finally:
+            fcntl.flock(slot, fcntl.LOCK_UN)
+            slot.close()
+
+    def _acquire(self):
+        while True:
+            for path in random.sample(self.paths, len(self.paths)):
+                slot = open(path, "a")
+                try:
+                    fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot
+                except BlockingIOError:
+                    slot.close()
+            time.sleep(self.poll_interval)
+
+class ApiClient:
+    """Pooled, rate-limited HTTP client for one provider.
+
+    Requests that fail with a retryable status or a connection error are
+    retried with full-jitter backoff, honoring Retry-After. With hedge_after
+    set, an identical request is started if the first one hasn't answered by
+    then and whichever finishes first wins.
+    """
+
+    def __init__(self, provider, base_url, headers, rate_per_second=2, burst=4, max_concurrency=4,
+            timeout=120, max_retries=4, backoff_base=0.5, backoff_cap=20, hedge_after=None, state_dir=API_STATE_DIR):
+        self.provider = provider
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_after = hedge_after
+
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(4, max_concurrency * 2))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        os.makedirs(state_dir, exist_ok=True)
+        self.bucket = TokenBucket(os.path.join(state_dir, f"{provider}.bucket"), rate_per_second, burst)
+        self.slots = ConcurrencySlots(os.path.join(state_dir, provider), max_concurrency)
+
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.latencies = []
+
+    def request(self, method, path, operation="request", hedge=False, **kwargs):
+        """Send a request and return the response, raising ApiError once retries run out."""
+        with span(f"api_{self.provider}_{operation}"):
+            start_time = time.perf_counter()
+            if hedge and self.hedge_after:
+                response = self._hedged(method, path, kwargs)
+            else:
+                response = self._with_retries(method, path, kwargs)
+            latency = time.perf_counter() - start_time
+
+        with self._stats_lock:
+            self.calls += 1
+            self.latencies.append(latency)
+            del self.latencies[:-1000]
+        return response
+
+    def _hedged(self, method, path, kwargs):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        try:
+            futures = [executor.submit(self._with_retries, method, path, kwargs)]
+            done, _ = concurrent.futures.wait(futures, timeout=self.hedge_after)
+            if not done:
+                with self._stats_lock:
+                    self.hedges += 1
+                print(f"{self.provider} {path} slower than {self.hedge_after}s, sending a hedged request")
+                futures.append(executor.submit(self._with_retries, method, path, kwargs))
+
+            errors = []
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    return future.result()
+                except ApiError as e:
+                    errors.append(e)
+            raise errors[0]
+        finally:
+            # The losing request is left to finish in the background
+            executor.shutdown(wait=False)
+
+    def _with_retries(self, method, path, kwargs):
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                self.bucket.acquire()
+                with self.slots.hold():
+                    response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = ApiError(f"{self.provider} {path} failed: {e}")
+            else:
+                if response.status_code < 400:
+                    return response
+                error = ApiError(f"{self.provider} {path} returned {response.status_code}: {response.text[:200]}",
+                                 response.status_code)
+                if response.status_code not in RETRY_STATUSES:
+                    raise error
+                retry_after = self._retry_after(response)
+
+            if attempt == self.max_retries:
+                raise error
+            delay = retry_after if retry_after is not None else random.uniform(
+                0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+            with self._stats_lock:
+                self.retries += 1
+            print(f"{error}, retrying in {delay:.2f}s ({attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+
+    def _retry_after(self, response):
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return min(float(value), self.backoff_cap)
+        except ValueError:
+            return None
+
+    def stats(self):
+        with self._stats_lock:
+            latencies = sorted(self.latencies)
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "hedges": self.hedges,
+                "p50_latency": latencies[len(latencies) // 2] if latencies else None,
+                "p95_latency": latencies[int(len(latencies) * 0.95)] if latencies else None
+            }
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(provider, base_url, headers):
+    """The process's client for a provider and base URL, created on first use.
+
+    Clients are rebuilt after a fork so worker processes never share pooled sockets.
+    """
+    key = (provider, base_url)
+    with _clients_lock:
+        client, pid = _clients.get(key, (None, None))
+        if client is None or pid != os.getpid():
+            client = ApiClient(provider, base_url, headers, **API_LIMITS.get(provider, {}))
+            _clients[key] = (client, os.getpid())
+        return client
+
+def elevenlabs_client():
+    # The base URLs can be pointed at a local stub server through the environment
+    base_url = os.environ.get("ELEVENLABS_BASE_URL", ELEVENLABS_BASE_URL)
+    return get_client("elevenlabs", base_url, {"xi-api-key": ELEVENLABS_API_KEY})
+
+def openai_client():
+    base_url = os.environ.get("OPENAI_BASE_URL", OPENAI_BASE_URL)
+    return get_client("openai", base_url, {"Authorization": f"Bearer {OPENAI_API_KEY}"})
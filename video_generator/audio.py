@@ -1,43 +1,155 @@
 import numpy as np
-from moviepy import AudioFileClip, concatenate_audioclips, AudioClip
+from moviepy import AudioFileClip
 import os
 
+from video_generator.metrics import span
+from video_generator.pcm import SAMPLE_RATE, decode_audio, write_wav, active_rms
+
+# Speech is normalized to this level, music plays at MUSIC_VOLUME times it
+# and is scaled by another DUCK_VOLUME while someone is talking
+TARGET_LOUDNESS_DBFS = -18
+MUSIC_VOLUME = 0.25
+DUCK_VOLUME = 0.35
+PEAK_LIMIT = 0.95
+
+def _db_to_gain(db):
+    return 10 ** (db / 20)
+
+def fit_to_length(samples, length):
+    """Loop or trim samples to exactly length frames."""
+    if len(samples) == 0:
+        return np.zeros((length, samples.shape[1]), dtype=np.float32)
+    repeats = -(-length // len(samples))
+    return np.tile(samples, (repeats, 1))[:length]
+
+def duck_envelope(speech, sample_rate, duck_volume=DUCK_VOLUME, frame_duration=0.01,
+        threshold=0.05, release=0.3, ramp=0.05):
+    """Per-sample gain for the music: duck_volume under speech, 1 elsewhere.
+
+    Frames louder than threshold relative to the loudest frame count as
+    speech. The mask is held for release seconds so the music doesn't pump
+    between words, then smoothed into ramp-second fades.
+    """
+    frame_length = max(1, int(frame_duration * sample_rate))
+    n_frames = -(-len(speech) // frame_length)
+    padded = np.zeros(n_frames * frame_length, dtype=np.float32)
+    padded[:len(speech)] = speech[:, 0] if speech.shape[1] == 1 else np.abs(speech).max(axis=1)
+    frames = padded.reshape(n_frames, frame_length)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    if rms.max() == 0:
+        return np.ones(len(speech), dtype=np.float32)
+    talking = (rms > rms.max() * threshold).astype(np.float32)
+
+    hold = max(1, int(release / frame_duration))
+    talking = np.minimum(np.convolve(talking, np.ones(hold), mode="full")[:n_frames], 1)
+    window = max(1, int(ramp / frame_duration))
+    talking = np.convolve(talking, np.ones(window) / window, mode="same")
+
+    # Linear ramp from each frame's gain to the next one's, in float32 to keep it cheap
+    frame_gain = (1 - (1 - duck_volume) * talking).astype(np.float32)
+    steps = np.diff(frame_gain, append=frame_gain[-1])
+    fraction = np.arange(frame_length, dtype=np.float32) / frame_length
+    gain = frame_gain[:, None] + steps[:, None] * fraction
+    return gain.reshape(-1)[:len(speech)]
+
 class Audio:
-    def __init__(self, voices_clips=[], audio_path="", pause_duration=1, audio_temp_name="temp.mp3", folder="temp"):
-        self._output_path = folder+"/"+audio_temp_name
+    """The job's soundtrack, kept as one PCM WAV.
+
+    Every later stage reads this file by path, and it is only encoded to AAC
+    when it is muxed into the final video.
+    """
+
+    def __init__(self, voices=[], audio_path="", pause_duration=1, audio_temp_name="temp.wav", folder="temp",
+            sample_rate=SAMPLE_RATE, music_volume=MUSIC_VOLUME, duck_volume=DUCK_VOLUME):
+        self._output_path = os.path.join(folder, os.path.splitext(audio_temp_name)[0] + ".wav")
         self.audio_path = audio_path
-        self.voices_clips = voices_clips
+        self.voices = voices
+        self.sample_rate = sample_rate
+        self.pause_duration = pause_duration
+        self._audio_clip = None
 
-        self.voices_clips.insert(1, self._create_silence_audio_clip(pause_duration))
-        print("Inserted silence clip")
-        self._conconate_voices()
-        self._save_audio()
-        self._audio_clip = AudioFileClip(self._output_path)
+        with span("audio_mix"):
+            speech = self._assemble_speech()
+            mix = self._mix_music(speech, music_volume, duck_volume)
+        self._save_audio(mix)
+        self._frames = len(mix)
 
     @property
     def audio_clip(self):
+        # Only opened for callers that still want a moviepy clip
+        if self._audio_clip is None:
+            self._audio_clip = AudioFileClip(self._output_path)
         return self._audio_clip
 
     @property
     def output_path(self):
         return self._output_path
 
-    def _create_silence_audio_clip(self, duration: float, fps=30, nchannels: int = 1) -> AudioClip:
-        make_frame_silence = lambda t: [0] * nchannels
-        silence_clip = AudioClip(make_frame_silence, duration=duration, fps=fps)
-        print(f"Silence clip created")
-        return silence_clip
+    @property
+    def duration(self):
+        return self._frames / self.sample_rate
+
+    def _load_voice(self, voice):
+        if isinstance(voice, str):
+            return decode_audio(voice, self.sample_rate)
+        return voice
+
+    def _assemble_speech(self):
+        # Voices arrive already decoded (or are decoded here once); the pause after the title is a block of zeros
+        voices = [self._load_voice(voice) for voice in self.voices]
+        silence = np.zeros((int(round(self.pause_duration * self.sample_rate)), 1), dtype=np.float32)
+
+        segments = []
+        # Where each voice starts in the mix, in seconds
+        self.voice_starts = []
+        position = 0
+        for i, voice in enumerate(voices):
+            if i == 1:
+                segments.append(silence)
+                position += len(silence)
+            self.voice_starts.append(position / self.sample_rate)
+            segments.append(voice)
+            position += len(voice)
+        speech = np.concatenate(segments) if segments else silence
+
+        rms = active_rms(speech)
+        if rms > 0:
+            speech *= _db_to_gain(TARGET_LOUDNESS_DBFS) / rms
+        print(f"Assembled {len(voices)} voices into {len(speech) / self.sample_rate:.2f}s of speech")
+        return speech
+
+    def _mix_music(self, speech, music_volume, duck_volume):
+        if not self.audio_path:
+            return self._limit(speech)
+        if not os.path.exists(self.audio_path):
+            raise FileNotFoundError(f"Background audio not found: {self.audio_path}")
+
+        music = fit_to_length(decode_audio(self.audio_path, self.sample_rate, channels=2), len(speech))
+        music_rms = active_rms(music.mean(axis=1, keepdims=True))
+        if music_rms > 0:
+            music *= _db_to_gain(TARGET_LOUDNESS_DBFS) * music_volume / music_rms
+
+        gain = duck_envelope(speech, self.sample_rate, duck_volume)
+        music *= gain[:, None]
+        music += speech
+        mix = music
+        print(f"Mixed background audio {self.audio_path} under the voices")
+        return self._limit(mix)
 
-    def _conconate_voices(self):
-        self.final_clip = concatenate_audioclips(self.voices_clips)
-        print(f"Final audio clip was concantenated: {self._output_path}")
+    def _limit(self, samples):
+        peak = np.abs(samples).max() if len(samples) else 0
+        if peak > PEAK_LIMIT:
+            samples *= PEAK_LIMIT / peak
+        return samples
 
-    def _save_audio(self):
-        self.final_clip.write_audiofile(self._output_path, codec='mp3')
-        self.final_clip.close()
+    def _save_audio(self, mix):
+        os.makedirs(os.path.dirname(self._output_path) or ".", exist_ok=True)
+        with span("audio_write", output_path=self._output_path):
+            write_wav(mix, self._output_path, self.sample_rate)
         print(f"Saved final audio to: {self._output_path}")
 
     def delete(self):
-        self._audio_clip.close()
+        if self._audio_clip is not None:
+            self._audio_clip.close()
         #os.remove(self._output_path)
-        print(f"Deleted audio file: {self._output_path}")
\ No newline at end of file
+        print(f"Deleted audio file: {self._output_path}")
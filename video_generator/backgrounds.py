@@ -0,0 +1,150 @@
+import concurrent.futures
+import hashlib
+import random
+import fcntl
+import json
+import time
+import os
+from contextlib import contextmanager
+
+from config import BACKGROUND_REUSE_WINDOW
+from video_generator.probe import probe
+
+# One index per background folder, named after a digest of its absolute path
+BACKGROUND_INDEX_DIR = "temp/background_index"
+# Segments handed out to renders, shared by every worker process
+BACKGROUND_USAGE_PATH = os.environ.get("BACKGROUND_USAGE_PATH", "temp/background_usage.json")
+
+@contextmanager
+def locked_json(path):
+    """Load a JSON file under an exclusive flock and write it back atomically on exit."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            yield data
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(temp_path, path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class BackgroundIndex:
+    """Duration, resolution, fps and codec of every clip in a background folder.
+
+    Kept on disk and refreshed incrementally: only files whose size or mtime
+    changed since the last scan are probed again.
+    """
+
+    def __init__(self, folder, index_dir=BACKGROUND_INDEX_DIR):
+        self.folder = os.path.abspath(folder)
+        name = hashlib.sha256(self.folder.encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(index_dir, f"{name}.json")
+
+    def refresh(self, max_workers=4):
+        """Bring the index up to date with the folder and return its usable clips sorted by path."""
+        files = {}
+        for file in os.listdir(self.folder):
+            if file.startswith(".") or ".ds_store" in file.lower():
+                continue
+            path = os.path.join(self.folder, file)
+            stat = os.stat(path)
+            if os.path.isfile(path):
+                files[path] = (stat.st_size, stat.st_mtime_ns)
+
+        with locked_json(self.path) as index:
+            for path in list(index):
+                if path not in files:
+                    del index[path]
+            changed = [path for path, (size, mtime_ns) in files.items()
+                       if path not in index or (index[path]["size"], index[path]["mtime_ns"]) != (size, mtime_ns)]
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for path, info in zip(changed, executor.map(self._probe, changed)):
+                    size, mtime_ns = files[path]
+                    index[path] = dict(info, path=path, size=size, mtime_ns=mtime_ns)
+
+            clips = sorted((dict(entry) for entry in index.values() if entry.get("duration")),
+                           key=lambda clip_info: clip_info["path"])
+
+        print(f"Indexed {len(clips)} background clips in {self.folder} ({len(changed)} probed)")
+        return clips
+
+    def _probe(self, path):
+        try:
+            info = probe(path)
+        except Exception as e:
+            print(f"Error reading clip {path}: {e}")
+            return {"duration": None}
+        return {key: info[key] for key in ("duration", "width", "height", "fps", "video_codec")}
+
+def _overlap(start, end, used):
+    return sum(max(0, min(end, used_end) - max(start, used_start)) for used_start, used_end, _ in used)
+
+def _segment_start(duration, take, used, rng):
+    # Prefer a start right after a used range, or at the beginning, that overlaps nothing
+    candidates = [0] + [used_end for _, used_end, _ in used] + [rng.uniform(0, duration - take)]
+    candidates = [start for start in candidates if start + take <= duration]
+    return min(candidates, key=lambda start: (_overlap(start, start + take, used), start))
+
+def plan_segments(clips, length, usage=None, rng=None):
+    """Pick (path, start, end) segments whose durations add up to exactly length.
+
+    Clips nobody used recently come first. A clip is used whole while it
+    fits and the last one is trimmed; a trimmed segment avoids the parts of
+    its clip other renders used recently.
+    """
+    rng = rng or random.Random()
+    # Copied, so segments of this plan count as used for the rest of it
+    usage = {path: list(used) for path, used in (usage or {}).items()}
+    clips = [clip_info for clip_info in clips if clip_info.get("duration")]
+    if not clips:
+        raise ValueError("No usable background clips")
+
+    def last_used(clip_info):
+        return max((used_at for _, _, used_at in usage.get(clip_info["path"], [])), default=0)
+
+    order = sorted(clips, key=lambda clip_info: (last_used(clip_info), rng.random()))
+    segments = []
+    remaining = length
+    while remaining > 1e-3:
+        for clip_info in order:
+            if remaining <= 1e-3:
+                break
+            take = min(clip_info["duration"], remaining)
+            used = usage.get(clip_info["path"], [])
+            start = _segment_start(clip_info["duration"], take, used, rng)
+            segments.append({"path": clip_info["path"], "start": round(start, 3), "end": round(start + take, 3)})
+            usage.setdefault(clip_info["path"], []).append([start, start + take, time.time()])
+            remaining -= take
+    return segments
+
+class BackgroundUsage:
+    """Segments recently given to renders, so concurrent and back-to-back jobs don't repeat footage."""
+
+    def __init__(self, path=BACKGROUND_USAGE_PATH, window=BACKGROUND_REUSE_WINDOW):
+        self.path = path
+        self.window = window
+
+    def plan(self, clips, length, rng=None):
+        """Plan segments for a render and record them, in one step under the usage lock."""
+        with locked_json(self.path) as usage:
+            cutoff = time.time() - self.window
+            for path in list(usage):
+                usage[path] = [entry for entry in usage[path] if entry[2] > cutoff]
+                if not usage[path]:
+                    del usage[path]
+
+            segments = plan_segments(clips, length, usage, rng)
+            now = time.time()
+            for segment in segments:
+                usage.setdefault(segment["path"], []).append([segment["start"], segment["end"], now])
+        return segments
+
+background_usage = BackgroundUsage()
@@ -0,0 +1,139 @@
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+from video_generator.overlay import Bitmap
+
+# Finished caption bitmaps kept per process, short chunks like "I was" repeat a lot
+CAPTION_CACHE_SIZE = 512
+
+class GlyphAtlas:
+    """Coverage masks of every glyph of one font, rasterized the first time they are used."""
+
+    def __init__(self, font_path, font_size):
+        self.font = ImageFont.truetype(font_path, font_size)
+        ascent, descent = self.font.getmetrics()
+        self.line_height = ascent + descent
+        self._glyphs = {}
+        self._lock = threading.Lock()
+
+    def glyph(self, char):
+        glyph = self._glyphs.get(char)
+        if glyph is None:
+            with self._lock:
+                glyph = self._glyphs.get(char)
+                if glyph is None:
+                    glyph = self._rasterize(char)
+                    self._glyphs[char] = glyph
+        return glyph
+
+    def _rasterize(self, char):
+        left, top, right, bottom = self.font.getbbox(char)
+        advance = self.font.getlength(char)
+        if right <= left or bottom <= top:
+            return None, left, top, advance
+
+        image = Image.new("L", (right - left, bottom - top), 0)
+        ImageDraw.Draw(image).text((-left, -top), char, font=self.font, fill=255)
+        return np.asarray(image), left, top, advance
+
+    def text_width(self, text):
+        return sum(self.glyph(char)[3] for char in text)
+
+    def wrap(self, text, max_width):
+        lines = []
+        current_line = ""
+        for word in text.split():
+            candidate = f"{current_line} {word}" if current_line else word
+            if current_line and self.text_width(candidate) > max_width:
+                lines.append(current_line)
+                current_line = word
+            else:
+                current_line = candidate
+        if current_line:
+            lines.append(current_line)
+        return lines
+
+class CaptionRenderer:
+    """Lays out captions from glyph atlases and caches the finished bitmaps."""
+
+    def __init__(self, cache_size=CAPTION_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._atlases = {}
+        self._bitmaps = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_atlas(self, font_path, font_size):
+        key = (font_path, font_size)
+        with self._lock:
+            atlas = self._atlases.get(key)
+            if atlas is None:
+                atlas = GlyphAtlas(font_path, font_size)
+                self._atlases[key] = atlas
+        return atlas
+
+    def render(self, text, font_path, font_size, color="white", bg_color=None, box_size=(864, 50)):
+        """Return a Bitmap of text wrapped and centered in a box, like TextClip(method="caption")."""
+        key = (text, font_path, font_size, color, bg_color, box_size)
+        with self._lock:
+            bitmap = self._bitmaps.get(key)
+            if bitmap is not None:
+                self._bitmaps.move_to_end(key)
+                self.hits += 1
+                return bitmap
+            self.misses += 1
+
+        bitmap = self._compose(text, self._get_atlas(font_path, font_size), color, bg_color, box_size)
+
+        with self._lock:
+            self._bitmaps[key] = bitmap
+            if len(self._bitmaps) > self.cache_size:
+                self._bitmaps.popitem(last=False)
+        return bitmap
+
+    def _compose(self, text, atlas, color, bg_color, box_size):
+        box_width, box_height = box_size
+        lines = atlas.wrap(text, box_width)
+        height = max(box_height, len(lines) * atlas.line_height)
+        coverage = np.zeros((height, box_width), dtype=np.uint8)
+
+        top = (height - len(lines) * atlas.line_height) // 2
+        for line in lines:
+            pen_x = (box_width - atlas.text_width(line)) / 2
+            for char in line:
+                mask, left, glyph_top, advance = atlas.glyph(char)
+                if mask is not None:
+                    x, y = int(round(pen_x + left)), top + glyph_top
+                    # Clip glyphs that spill out of the box
+                    x0, y0 = max(x, 0), max(y, 0)
+                    x1, y1 = min(x + mask.shape[1], box_width), min(y + mask.shape[0], height)
+                    if x0 < x1 and y0 < y1:
+                        region = coverage[y0:y1, x0:x1]
+                        np.maximum(region, mask[y0 - y:y1 - y, x0 - x:x1 - x], out=region)
+                pen_x += advance
+            top += atlas.line_height
+
+        rgb = np.empty((height, box_width, 3), dtype=np.uint8)
+        rgb[:] = ImageColor.getrgb(color)[:3]
+        if bg_color is not None:
+            # An opaque box: blend the text over the background color
+            background = np.array(ImageColor.getrgb(bg_color)[:3], dtype=np.uint16)
+            alpha = coverage.astype(np.uint16)[:, :, None]
+            rgb = ((rgb * alpha + background * (255 - alpha)) // 255).astype(np.uint8)
+            return Bitmap(rgb, np.full((height, box_width), 255, dtype=np.uint8))
+
+        # Crop to the inked area so every frame blends as few pixels as possible
+        rows = np.flatnonzero(coverage.any(axis=1))
+        columns = np.flatnonzero(coverage.any(axis=0))
+        if len(rows) == 0:
+            return Bitmap(rgb[:1, :1], coverage[:1, :1], box_size=(box_width, height))
+        y0, y1 = rows[0], rows[-1] + 1
+        x0, x1 = columns[0], columns[-1] + 1
+        return Bitmap(rgb[y0:y1, x0:x1], coverage[y0:y1, x0:x1], offset=(int(x0), int(y0)), box_size=(box_width, height))
+
+# Shared by every Captions instance in the process
+caption_renderer = CaptionRenderer()
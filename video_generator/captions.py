@@ -1,64 +1,60 @@
-from moviepy import VideoFileClip, TextClip, CompositeVideoClip, AudioFileClip
-from openai import OpenAI
+from moviepy import VideoFileClip
+
+from video_generator.metrics import span
+from video_generator.timings import WhisperTimings
+from video_generator.overlay import Overlay, IntervalOverlay, resolve_position
+from video_generator.caption_renderer import caption_renderer
+from video_generator.mux import mux_audio
+from video_generator.timeline import Timeline, encode_sliced
+from video_generator.encoder_profiles import encoder_settings, x264_params
 
-from config import OPENAI_API_KEY
 
 from pprint import pprint
 import os
 import traceback
-import concurrent.futures
-import time
-
-client = OpenAI(api_key=OPENAI_API_KEY)
 
 class Captions:
-    def __init__(self, video_path, audio_path, output_path, capitalize=False, parallel_processing=False, max_workers=4):
+    def __init__(self, video_path, audio_path, output_path, capitalize=False, parallel_processing=False, max_workers=4, temp_dir="temp/captions_processing", timing_provider=None, quality="final", encoder_profile=None):
         self.video_path = video_path
+        self.temp_dir = temp_dir
         self.audio_path = audio_path
         self.output_path = output_path
         self.parallel_processing = parallel_processing
         self.max_workers = max_workers
+        # Word timings come from the TTS alignment when the caller has it, Whisper otherwise
+        self.timing_provider = timing_provider or WhisperTimings()
+        # Captions are drawn at the quality's scale to match the frame they go on
+        self.quality = encoder_settings(quality, encoder_profile, max_threads=max_workers)
         
-        self._open_video()
-        transcript = self._get_transcript()
-        timestamps = self._get_timestamps(transcript)
+        # Without a video path the transcript is fetched first and the video
+        # is attached later with set_video (single-pass rendering)
+        self.video = None
+        self.timeline = None
+        if self.video_path:
+            self._open_video()
+        timestamps = self.timing_provider.get_word_timestamps(self.audio_path)
         self.final_captions = self._concatenate_timestamps(timestamps, capitalize=capitalize)
         pprint(self.final_captions)
 
-        self.created_text_clips = []
-
     def _open_video(self):
         self.video = VideoFileClip(self.video_path)
 
-    def close(self):
-        self.video.close()
-        print("original video closed")
+    def set_video(self, video, timeline=None):
+        self.video = video
+        # How the video was composited, needed to encode it in slices
+        self.timeline = timeline
+        print("attached video to captions")
 
-        self._close_all_text_clips()
-        print("closed all text clips")
+    @property
+    def frame_size(self):
+        if self.video is not None:
+            return tuple(self.video.size)
+        return self.timeline.size
 
-    def _get_audio_file(self):
-        audio_file = open(self.audio_path, "rb")
-        return audio_file
-
-    def _get_transcript(self):
-        transcription = client.audio.transcriptions.create(
-            file=self._get_audio_file(),
-            model="whisper-1",
-            response_format="verbose_json",
-            timestamp_granularities=["word"]
-        )
-        return transcription
-
-    def _get_timestamps(self, transcript):
-        timestamps = []
-        for word in transcript.words:
-            timestamps.append({
-                "word": word.word,
-                "start": round(float(word.start), 2),
-                "end": round(float(word.end), 2)
-            })
-        return timestamps
+    def close(self):
+        if self.video is not None:
+            self.video.close()
+            print("original video closed")
 
     def _concatenate_timestamps(self, word_timestamps, max_words=3, max_gap=0.05, capitalize=False):
         sentences = []
@@ -109,24 +105,6 @@ class Captions:
 
         return sentences
 
-    def _create_text_clip(self, text, start, end, font_path, font_size, color, bg_color, position, caption_box_width):
-        text_clip = TextClip(font_path, 
-            text, 
-            font_size=font_size, 
-            color=color, 
-            bg_color=bg_color,
-            size=(caption_box_width, 50),
-            method="caption"
-        )
-        text_clip = text_clip.with_position(position, relative=True).with_start(start).with_duration(end - start)
-        self.created_text_clips.append(text_clip)
-        print(f"created text clip with \"{text}\" from {start} to {end}")
-        return text_clip
-
-    def _add_text_clip_to_video(self, text_clip):
-        self.video = CompositeVideoClip([self.video, text_clip])
-        self.created_text_clips.append(text_clip)
-
     def clear_title_captions(self):
         if len(self.final_captions) <= 1:
             print("Not enough captions to clear title")
@@ -143,57 +121,42 @@ class Captions:
                 print(f"Cleared title captions, keeping {len(self.final_captions)} remaining captions")
                 break
 
-    def _create_text_clip_for_caption(self, caption, font_path, font_size, color, bg_color, position, caption_box_width):
-        return self._create_text_clip(caption['text'], caption['start'], caption['end'], 
-                                     font_path, font_size, color, bg_color, position, caption_box_width)
+    def _create_caption_overlay(self, caption, font_path, font_size, color, bg_color, position, box_size):
+        bitmap = caption_renderer.render(caption['text'], font_path, font_size, color, bg_color, box_size)
+        # Text that wraps to more lines makes the box taller than box_size, so it is
+        # placed by the height it was laid out at, like a caption TextClip
+        overlay_position = resolve_position(position, self.frame_size, bitmap.box_size)
+        return Overlay(bitmap, caption['start'], caption['end'], overlay_position)
 
     def add_captions_to_video(self, font_path, font_size, color, bg_color=None, position=('center', 0.85), caption_box_width=864):
-        if self.parallel_processing and len(self.final_captions) > 10:
-            print("Adding captions in parallel...")
-            # Create text clips in parallel
-            text_clips = []
-            
-            # Process captions in batches for better memory management
-            batch_size = min(20, len(self.final_captions))
-            
-            # Create a thread-safe function for creating text clips
-            create_clip_func = lambda caption: self._create_text_clip(
-                caption['text'], caption['start'], caption['end'],
-                font_path, font_size, color, bg_color, position, caption_box_width
-            )
-            
-            # Process in batches
-            for i in range(0, len(self.final_captions), batch_size):
-                batch = self.final_captions[i:i+batch_size]
-                
-                with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                    batch_clips = list(executor.map(create_clip_func, batch))
-                    text_clips.extend(batch_clips)
-                    
-                # Add the batch of clips to the video
-                print(f"Adding batch {i//batch_size + 1} of text clips to video...")
-                self.video = CompositeVideoClip([self.video] + text_clips)
-                
-                # Store the clips for later cleanup
-                self.created_text_clips.extend(text_clips)
-                
-                # Reset for next batch
-                text_clips = []
-        else:
-            # Original sequential method
-            for caption in self.final_captions:
-                text_clip = self._create_text_clip(caption['text'], caption['start'], caption['end'], font_path, font_size, color, bg_color, position, caption_box_width)
-                self._add_text_clip_to_video(text_clip)
-                print(f"added text clip with \"{caption['text']}\" from {caption['start']} to {caption['end']}")
+        scale = self.quality["scale"]
+        font_size = max(1, round(font_size * scale))
+        box_size = (round(caption_box_width * scale), max(1, round(50 * scale)))
+        with span("caption_clips"):
+            # Bitmaps come from the shared glyph atlases and cache, so this takes milliseconds
+            overlays = [
+                self._create_caption_overlay(caption, font_path, font_size, color, bg_color, position, box_size)
+                for caption in self.final_captions
+            ]
+            print(f"created {len(overlays)} caption bitmaps "
+                  f"(cache hits: {caption_renderer.hits}, misses: {caption_renderer.misses})")
+
+        with span("compositing"):
+            # One overlay layer that knows every caption interval, instead of
+            # nesting a CompositeVideoClip per caption that each frame has to walk
+            self.caption_layer = IntervalOverlay(overlays)
+            # With the ffmpeg engine there is no clip graph to transform, only the timeline
+            if self.video is not None:
+                self.video = self.video.transform(self.caption_layer.apply)
+            if self.timeline is None and self.video_path:
+                self.timeline = Timeline([{"path": self.video_path, "start": 0, "end": self.video.duration}],
+                                         size=self.frame_size)
+            if self.timeline is not None:
+                self.timeline.caption_layer = self.caption_layer
                 
         print("added all text clips to video")
-    
-    def _close_all_text_clips(self):
-        for text_clip in self.created_text_clips:
-            text_clip.close()
-        print("closed all text clips")
 
-    def save(self):
+    def save(self, encode_workers=1, engine="moviepy"):
         print(f"saving video to {self.output_path}")
         # Ensure the output directory exists
         output_dir = os.path.dirname(self.output_path)
@@ -201,54 +164,64 @@ class Captions:
             os.makedirs(output_dir, exist_ok=True)
         
         # Create a dedicated temp dir for this specific operation
-        temp_dir = os.path.abspath("temp/captions_processing")
+        temp_dir = os.path.abspath(self.temp_dir)
         os.makedirs(temp_dir, exist_ok=True)
         print(f"Using temp directory for captions processing: {temp_dir}")
         
-        audio = AudioFileClip(self.audio_path)
-        self.video.audio = audio
-        print("added audio to video")
-        
         # Use CPU count to determine optimal thread count
         import multiprocessing
         cpu_count = multiprocessing.cpu_count()
-        optimal_threads = min(cpu_count, 8)  # Use up to 8 threads or available CPUs
+        optimal_threads = self.quality.get("threads") or min(cpu_count, 8)  # Use up to 8 threads or available CPUs
         
         # Optimize video encoding settings for faster processing
         # Note: These settings prioritize speed over quality, adjust if needed
-        start_time = time.time()
         print(f"Starting final video encoding with {optimal_threads} threads...")
         
-        try:
-            # Use H.264 preset for faster encoding
-            self.video.write_videofile(
-                self.output_path, 
-                codec='libx264', 
-                audio_codec='aac',
-                logger="bar",
-                temp_audiofile=os.path.join(temp_dir, "temp_audio.m4a"),
-                remove_temp=True,
-                threads=optimal_threads,
-                preset="ultrafast",         # Use fastest preset (options: ultrafast, superfast, veryfast, faster, fast, medium, slow, slower, veryslow)
-                ffmpeg_params=["-crf", "28"] # Higher CRF = lower quality but faster encoding (18-28 is reasonable)
-            )
-            encoding_time = time.time() - start_time
-            print(f"Video encoding completed in {encoding_time:.2f} seconds")
-        except Exception as e:
-            print(f"Error during video encoding: {e}")
-            # Try fallback method with safer settings
-            print("Trying fallback encoding method...")
-            self.video.write_videofile(
-                self.output_path, 
-                codec='libx264', 
-                audio_codec='aac',
-                logger="bar",
-                threads=optimal_threads
-            )
-            
+        # The video is encoded on its own and the PCM soundtrack is encoded to
+        # AAC exactly once while muxing, instead of moviepy transcoding it again
+        video_only_path = os.path.join(temp_dir, "video_only.mp4")
+        if (encode_workers > 1 or engine != "moviepy") and self.timeline is not None:
+            with span("final_encode", output_path=video_only_path):
+                encode_sliced(self.timeline, video_only_path, encode_workers,
+                              os.path.join(temp_dir, "slices"), fps=self.quality["fps"], preset=self.quality["preset"],
+                              crf=self.quality["crf"], gop_seconds=self.quality.get("gop_seconds", 1), tune=self.quality.get("tune"),
+                              total_threads=self.quality.get("threads") or cpu_count, engine=engine)
+        else:
+            self._encode(video_only_path, optimal_threads)
+
+        with span("mux", output_path=self.output_path):
+            mux_audio(video_only_path, self.audio_path, self.output_path)
+        os.remove(video_only_path)
         print("saved video")
-        audio.close()
-        print("closed audio")
+
+    def _encode(self, video_only_path, optimal_threads):
+        with span("final_encode", output_path=video_only_path):
+            try:
+                # Use H.264 preset for faster encoding
+                self.video.write_videofile(
+                    video_only_path, 
+                    codec='libx264', 
+                    audio=False,
+                    fps=self.quality["fps"],
+                    logger="bar",
+                    threads=optimal_threads,
+                    preset=self.quality["preset"],         # From config.QUALITY_LEVELS or a tuned encoder profile
+                    ffmpeg_params=x264_params(self.quality, self.quality["fps"]) # Higher CRF = lower quality but faster encoding
+                )
+            except Exception as e:
+                print(f"Error during video encoding: {e}")
+                # Fall back without the tune and GOP flags, keeping the preset and CRF
+                print("Trying fallback encoding method...")
+                self.video.write_videofile(
+                    video_only_path, 
+                    codec='libx264', 
+                    audio=False,
+                    fps=self.quality["fps"],
+                    logger="bar",
+                    threads=optimal_threads,
+                    preset=self.quality["preset"],
+                    ffmpeg_params=["-crf", str(self.quality["crf"])]
+                )
 
 if __name__ == "__main__":
     video = Captions("output/something.mp4", "temp/temp.mp3", "output/something_captions.mp4",
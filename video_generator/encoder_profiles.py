@@ -0,0 +1,45 @@
+"""Named x264 settings measured on this host by tune_encoder.py.
+
+A profile only carries encoder settings (preset, crf, threads, tune,
+gop_seconds). It is applied over a QUALITY_LEVELS entry, which still
+decides the scale and frame rate of the render.
+"""
+import json
+import os
+
+from config import QUALITY_LEVELS, ENCODER_PROFILES_PATH
+
+PROFILE_KEYS = ("preset", "crf", "threads", "tune", "gop_seconds")
+
+def load_encoder_profiles(path=ENCODER_PROFILES_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get("profiles", {})
+
+def encoder_settings(quality="final", encoder_profile=None, path=ENCODER_PROFILES_PATH, max_threads=None):
+    """The settings a render encodes with: the quality level, overridden by the profile if one is named.
+
+    A profile's thread count was measured with the whole host to itself, so
+    it is capped at max_threads, the render's share of the CPUs.
+    """
+    if quality not in QUALITY_LEVELS:
+        raise ValueError(f"Unknown quality {quality!r}, expected one of {', '.join(QUALITY_LEVELS)}")
+    settings = dict(QUALITY_LEVELS[quality])
+    if encoder_profile:
+        profiles = load_encoder_profiles(path)
+        if encoder_profile not in profiles:
+            raise ValueError(f"Unknown encoder profile {encoder_profile!r}, run tune_encoder.py to create it")
+        settings.update({key: profiles[encoder_profile][key] for key in PROFILE_KEYS if key in profiles[encoder_profile]})
+    if max_threads and settings.get("threads"):
+        settings["threads"] = min(settings["threads"], max_threads)
+    return settings
+
+def x264_params(settings, fps):
+    """ffmpeg_params for the settings, apart from the preset that moviepy takes separately."""
+    params = ["-crf", str(settings["crf"])]
+    if settings.get("tune"):
+        params += ["-tune", settings["tune"]]
+    if settings.get("gop_seconds"):
+        params += ["-g", str(int(round(settings["gop_seconds"] * fps)))]
+    return params
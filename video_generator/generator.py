@@ -1,11 +1,17 @@
-from video_generator.video import Video
-from video_generator.voice import Voice
+from video_generator.video import Video, list_background_clips
+from video_generator.label import label_renderer, LABEL_SCALE
+from video_generator.voice import Voice, resolve_voice_name
 from video_generator.audio import Audio
 from video_generator.captions import Captions
+from video_generator.workspace import Workspace
+from video_generator.timeline import ENGINES
+from video_generator.timings import AlignmentTimings, WhisperTimings, TIMING_SOURCES
+from video_generator.mux import encode_preview, preview_path
+from video_generator.metrics import span
+
+from video_generator.encoder_profiles import encoder_settings
 
 import os
-import tempfile
-import glob
 import concurrent.futures
 from functools import partial
 import time
@@ -22,84 +28,110 @@ os.environ['TMPDIR'] = temp_dir
 # Print current working directory for debugging
 print(f"Current working directory: {os.getcwd()}")
 
-def generate_video(main_text, 
-        title_text, 
-        video_output_path, 
-        background_clips_folder="assets/backgrounds/minecraft/parkour1/", 
-        temp_voices_folder="temp/voices", 
-        temp_audio_folder="temp/audio",
-        capitalize=False,
-        audio_temp_name="temp.mp3",
-        pause_duration=1,
-        background_audio_path="",
-        voice_name="random",
-        voice_title_output_name="title.mp3",
-        voice_text_output_name="text.mp3",
-        label_name="label_1",
-        font_path="assets/fonts/roboto.ttf",
-        font_size=36,
-        color='white',
-        position=('center'),
-        caption_box_width=864,
-        video_name = "video",
-        max_workers=4,  # Number of parallel workers
-        fast_mode=True  # Enable fast mode for maximum speed
-    ):
-    print("-"*30, video_name, "-"*30)
-    print("Generating video with title: ", title_text)
-    
-    # Ensure directories exist
-    os.makedirs(temp_voices_folder, exist_ok=True)
-    os.makedirs(temp_audio_folder, exist_ok=True)
-    os.makedirs(os.path.dirname(video_output_path) or "output", exist_ok=True)
-    
-    # Ensure video_output_path starts with output/ directory
-    if not video_output_path.startswith("output/") and not os.path.dirname(video_output_path):
-        video_output_path = os.path.join("output", video_output_path)
-        print(f"Updated video output path to: {video_output_path}")
-    
-    # Keep track of all temp files created
-    temp_files_to_clean = []
-    
-    # Generate voices in parallel
-    print("Generating voices in parallel...")
-    start_time = time.time()
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit voice generation tasks
-        title_voice_future = executor.submit(
-            Voice, voice_name, title_text, voice_title_output_name, temp_voices_folder
+def _report_stage(progress_callback, stage):
+    # Lets the caller track progress and abort the job between stages
+    if progress_callback is not None:
+        progress_callback(stage)
+
+def _get_timing_provider(audio, text_voice, timing_source):
+    # The TTS alignment already says when every word of the story is spoken, so
+    # only the offset of the text voice in the mix is needed. The title is not
+    # part of it, which is what clear_title_captions used to strip out.
+    if timing_source == "alignment" and text_voice.alignment is not None:
+        print("Using TTS alignment for caption timings")
+        return AlignmentTimings(text_voice.alignment, offset=audio.voice_starts[1])
+    print("Using Whisper for caption timings")
+    return WhisperTimings()
+
+def _prepare_render(background_clips_folder, background_clips, max_workers, label_name, title_text, scale):
+    if background_clips is None:
+        background_clips = list_background_clips(background_clips_folder, max_workers)
+    # Video.add_label asks for the same label later and gets it from the cache
+    label_renderer.render(title_text, template=label_name, scale=LABEL_SCALE * scale)
+    return background_clips
+
+def _render_single_pass(audio, title_voice, text_voice, video_output_path, background_clips_folder,
+        capitalize, label_name, title_text, font_path, font_size, color, position,
+        caption_box_width, max_workers, workspace, progress_callback=None, background_clips=None,
+        timing_provider=None, encode_workers=1, engine="moviepy", quality="final", encoder_profile=None):
+    # Get the caption timings while the background clips are loading,
+    # then composite background, label and captions and encode them once
+    print("Rendering video in a single pass...")
+    _report_stage(progress_callback, "background")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        captions_future = executor.submit(
+            Captions, None, audio.output_path, video_output_path,
+            capitalize=capitalize,
+            parallel_processing=True,
+            max_workers=max_workers,
+            temp_dir=workspace.folder("captions_processing"),
+            timing_provider=timing_provider,
+            quality=quality,
+            encoder_profile=encoder_profile
         )
-        text_voice_future = executor.submit(
-            Voice, voice_name, main_text, voice_text_output_name, temp_voices_folder
+
+        print("Preparing video clips...")
+        video = Video(
+            video_output_path=video_output_path,
+            background_folder=background_clips_folder,
+            audio=audio,
+            parallel_processing=True,
+            max_workers=max_workers,
+            background_clips=background_clips,
+            temp_dir=workspace.folder("video_processing"),
+            engine=engine,
+            quality=quality,
+            encoder_profile=encoder_profile
         )
-        
-        # Wait for completion and get results
-        title_voice = title_voice_future.result()
-        text_voice = text_voice_future.result()
-    print(f"Voice generation completed in {time.time() - start_time:.2f} seconds")
-    
-    audio = Audio(
-        voices_clips=[title_voice.audio_clip, text_voice.audio_clip],
-        audio_path=background_audio_path,
-        pause_duration=pause_duration, 
-        audio_temp_name=audio_temp_name, 
-        folder=temp_audio_folder
-    )
+        video.add_label(label_name,
+            title_text,
+            title_voice.duration
+        )
+
+        video_with_captions = captions_future.result()
+
+    _report_stage(progress_callback, "captions")
+    if isinstance(video_with_captions.timing_provider, WhisperTimings):
+        video_with_captions.clear_title_captions()
+    video_with_captions.set_video(video.video, timeline=video.timeline())
+    video_with_captions.add_captions_to_video(
+                font_path=font_path,
+                font_size=font_size,
+                color=color,
+                position=position,
+                caption_box_width=caption_box_width
+            )
+
+    _report_stage(progress_callback, "encode")
+    video_with_captions.save(encode_workers=encode_workers, engine=engine)
 
-    # Create a full path for the intermediate file with proper directory
-    without_captions_path = video_output_path.split(".")[0]+"_without_captions.mp4"
-    if not os.path.dirname(without_captions_path):
-        without_captions_path = os.path.join("output", without_captions_path)
-    temp_files_to_clean.append(without_captions_path)
+    video_with_captions.close()
+    video.close_clips()
+    title_voice.delete()
+    text_voice.delete()
+    audio.delete()
+
+def _render_two_pass(audio, title_voice, text_voice, video_output_path, background_clips_folder,
+        capitalize, label_name, title_text, font_path, font_size, color, position,
+        caption_box_width, max_workers, workspace, progress_callback=None, background_clips=None,
+        timing_provider=None, encode_workers=1, engine="moviepy", quality="final", encoder_profile=None):
+    # The intermediate file lives in the job workspace
+    without_captions_path = workspace.file("without_captions.mp4")
     
     # Optimize video generation - preload clips in parallel
+    _report_stage(progress_callback, "background")
     print("Preparing video clips...")
     video = Video(
         video_output_path=without_captions_path, 
         background_folder=background_clips_folder, 
-        audio=audio.audio_clip,
+        audio=audio,
         parallel_processing=True,
-        max_workers=max_workers
+        max_workers=max_workers,
+        background_clips=background_clips,
+        temp_dir=workspace.folder("video_processing"),
+        engine=engine,
+        quality=quality,
+        encoder_profile=encoder_profile
     )
 
     video.add_label(label_name, 
@@ -107,10 +139,8 @@ def generate_video(main_text,
         title_voice.duration
     )
     
-    # Start timer for video generation
-    video_start_time = time.time()
-    video.save_video()
-    print(f"Initial video generation took {time.time() - video_start_time:.2f} seconds")
+    _report_stage(progress_callback, "first_encode")
+    video.save_video(encode_workers=encode_workers)
 
     video.close_clips()
     title_voice.delete()
@@ -118,17 +148,23 @@ def generate_video(main_text,
     audio.delete()
 
     # Create captions with optimized processing
+    _report_stage(progress_callback, "transcription")
     print("Generating captions...")
-    captions_start_time = time.time()
     video_with_captions = Captions(without_captions_path, 
                                 audio.output_path, 
                                 video_output_path, 
                                 capitalize=capitalize,
                                 parallel_processing=True,
-                                max_workers=max_workers
+                                max_workers=max_workers,
+                                temp_dir=workspace.folder("captions_processing"),
+                                timing_provider=timing_provider,
+                                quality=quality,
+                                encoder_profile=encoder_profile
     )
 
-    video_with_captions.clear_title_captions()
+    _report_stage(progress_callback, "captions")
+    if isinstance(video_with_captions.timing_provider, WhisperTimings):
+        video_with_captions.clear_title_captions()
     video_with_captions.add_captions_to_video(
                 font_path=font_path,
                 font_size=font_size,
@@ -137,39 +173,138 @@ def generate_video(main_text,
                 caption_box_width=caption_box_width
             )
 
-    video_with_captions.save()
-    print(f"Caption generation took {time.time() - captions_start_time:.2f} seconds")
+    _report_stage(progress_callback, "final_encode")
+    video_with_captions.save(encode_workers=encode_workers, engine=engine)
     video_with_captions.close()
     
-    # Clean up all temporary files
-    cleanup_files = [
-        without_captions_path,
-        os.path.join(temp_voices_folder, voice_title_output_name),
-        os.path.join(temp_voices_folder, voice_text_output_name),
-        os.path.join(temp_audio_folder, audio_temp_name)
-    ]
+    return without_captions_path
+
+def generate_video(main_text, 
+        title_text, 
+        video_output_path, 
+        background_clips_folder="assets/backgrounds/minecraft/parkour1/", 
+        temp_voices_folder="temp/voices", 
+        temp_audio_folder="temp/audio",
+        capitalize=False,
+        audio_temp_name="temp.mp3",
+        pause_duration=1,
+        background_audio_path="",
+        voice_name="random",
+        voice_title_output_name="title.mp3",
+        voice_text_output_name="text.mp3",
+        label_name="label_1",
+        font_path="assets/fonts/roboto.ttf",
+        font_size=36,
+        color='white',
+        position=('center'),
+        caption_box_width=864,
+        video_name = "video",
+        max_workers=4,  # Number of parallel workers
+        fast_mode=True,  # Enable fast mode for maximum speed
+        single_pass=True,  # Burn captions in during the first encode
+        progress_callback=None,  # Called with the name of each stage as it starts
+        background_clips=None,  # Pre-scanned background clip listing shared across a batch
+        workspace=None,  # Scratch directory for this job's intermediate files
+        timing_source="alignment",  # "alignment" uses the TTS word timings, "whisper" transcribes the audio
+        encode_workers=1,  # Above 1, the timeline is encoded in that many time slices side by side
+        engine="moviepy",  # "ffmpeg" composites with raw ffmpeg pipes instead of moviepy clips
+        quality="final",  # "draft" renders a quick low resolution preview, see QUALITY_LEVELS
+        preview_rendition=False,  # Also write a lower bitrate <video>_preview.mp4 for review
+        encoder_profile=None  # A profile from tune_encoder.py ("fast", "balanced", "small") over the quality's encoder settings
+    ):
+    print("-"*30, video_name, "-"*30)
+    print("Generating video with title: ", title_text)
+    # Fails before any voices are bought if the quality or profile doesn't exist
+    encoder_settings(quality, encoder_profile)
+    if timing_source not in TIMING_SOURCES:
+        raise ValueError(f"Unknown timing_source {timing_source!r}, expected one of {', '.join(TIMING_SOURCES)}")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {', '.join(ENGINES)}")
+    
+    # Ensure directories exist
+    os.makedirs(os.path.dirname(video_output_path) or "output", exist_ok=True)
+    
+    # Ensure video_output_path starts with output/ directory
+    if not video_output_path.startswith("output/") and not os.path.dirname(video_output_path):
+        video_output_path = os.path.join("output", video_output_path)
+        print(f"Updated video output path to: {video_output_path}")
     
-    print("Cleaning up temporary files...")
-    for temp_file in cleanup_files:
-        try:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
-                print(f"Removed {temp_file}")
-        except Exception as e:
-            print(f"Error removing {temp_file}: {e}")
-
-    # Additional cleanup for any temp files that match our pattern in the current directory
-    for pattern in ["*TEMP_MPY*", "*temp*", "*_without_captions*"]:
-        for file in glob.glob(pattern):
-            if os.path.isfile(file) and not file.startswith(("output/", "temp/", "assets/")):
-                try:
-                    os.remove(file)
-                    print(f"Removed temporary file: {file}")
-                except Exception as e:
-                    print(f"Error removing {file}: {e}")
+    # Intermediate files go to a per-job workspace instead of the shared
+    # temp_voices_folder and temp_audio_folder, so several renders can run side by side
+    owns_workspace = workspace is None
+    if owns_workspace:
+        workspace = Workspace()
+    temp_voices_folder = workspace.folder("voices")
+    temp_audio_folder = workspace.folder("audio")
+
+    start_time = time.time()
+    try:
+        # "random" is drawn from the story text, so re-renders hit the voice cache
+        # and the title and the story are read by the same voice
+        voice_name = resolve_voice_name(voice_name, main_text)
+
+        # Generate voices in parallel
+        _report_stage(progress_callback, "voices")
+        print("Generating voices in parallel...")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=1) as prepare_executor:
+            # Submit voice generation tasks
+            title_voice_future = executor.submit(
+                Voice, voice_name, title_text, voice_title_output_name, temp_voices_folder
+            )
+            text_voice_future = executor.submit(
+                Voice, voice_name, main_text, voice_text_output_name, temp_voices_folder
+            )
+
+            # What doesn't depend on the voices is done while they are generated:
+            # probing new background clips and drawing the label into the label cache
+            prepare_future = prepare_executor.submit(
+                _prepare_render, background_clips_folder, background_clips, max_workers,
+                label_name, title_text, encoder_settings(quality, encoder_profile)["scale"]
+            )
+        
+            # Wait for completion and get results
+            title_voice = title_voice_future.result()
+            text_voice = text_voice_future.result()
+            background_clips = prepare_future.result()
+    
+        _report_stage(progress_callback, "audio")
+        audio = Audio(
+            voices=[title_voice.samples, text_voice.samples],
+            audio_path=background_audio_path,
+            pause_duration=pause_duration, 
+            audio_temp_name=audio_temp_name, 
+            folder=temp_audio_folder
+        )
+        timing_provider = _get_timing_provider(audio, text_voice, timing_source)
+
+        if single_pass:
+            _render_single_pass(
+                audio, title_voice, text_voice, video_output_path, background_clips_folder,
+                capitalize, label_name, title_text, font_path, font_size, color, position,
+                caption_box_width, max_workers, workspace, progress_callback, background_clips,
+                timing_provider, encode_workers, engine, quality, encoder_profile
+            )
+        else:
+            _render_two_pass(
+                audio, title_voice, text_voice, video_output_path, background_clips_folder,
+                capitalize, label_name, title_text, font_path, font_size, color, position,
+                caption_box_width, max_workers, workspace, progress_callback, background_clips,
+                timing_provider, encode_workers, engine, quality, encoder_profile
+            )
+
+        if preview_rendition:
+            _report_stage(progress_callback, "preview")
+            with span("preview", output_path=preview_path(video_output_path)):
+                encode_preview(video_output_path, threads=max_workers)
+
+        _report_stage(progress_callback, "cleanup")
+    finally:
+        # Clean up all temporary files
+        if owns_workspace:
+            workspace.cleanup()
 
     total_time = time.time() - start_time
-    print("Cleared temp files")
     print(f"Final video saved to: {video_output_path}")
     print(f"Total video generation time: {total_time:.2f} seconds")
     print("-"*30, video_name, "-"*30)
@@ -1,69 +1,149 @@
 from PIL import Image, ImageDraw, ImageFont
+from functools import lru_cache
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+PRESET_FOLDER = 'labels/preset'
+# How big the label is drawn on the video, relative to its 660x220 layout
+LABEL_SCALE = 0.8
+# Rendered labels kept per process, keyed by everything that changes the pixels
+LABEL_CACHE_SIZE = 64
+
+DEFAULT_USERNAME = '@storiesbyjt'
+DEFAULT_TITLE = 'The Craigslist Ad That Shook Me For The Rest Of My Life...'
+
+# Fonts and preset images are loaded once per process and shared by every label it renders
+@lru_cache(maxsize=None)
+def _load_font(font_path, font_size):
+    return ImageFont.truetype(font_path, font_size)
+
+@lru_cache(maxsize=None)
+def _load_preset_image(image_path, size):
+    return Image.open(image_path).convert("RGBA").resize(size, Image.LANCZOS)
+
+def _scaled(value, scale):
+    return max(1, round(value * scale))
+
+class LabelRenderer:
+    """Draws labels straight at their on-screen size and caches the RGBA arrays.
+
+    Fonts are opened and preset images resized for the scale once, so a
+    label costs one draw per distinct title instead of a PNG written to disk
+    and scaled again by the compositor.
+    """
+
+    def __init__(self, cache_size=LABEL_CACHE_SIZE, scale=LABEL_SCALE):
+        self.cache_size = cache_size
+        self.scale = scale
+        self._labels = OrderedDict()
+        self._lock = threading.Lock()
+        # FreeType faces are shared between threads, so drawing is serialized
+        self._draw_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _font(self, size, scale):
+        return _load_font(f'{PRESET_FOLDER}/bold.otf', _scaled(size, scale))
+
+    def _image(self, name, size, scale):
+        return _load_preset_image(f'{PRESET_FOLDER}/{name}.png', (_scaled(size[0], scale), _scaled(size[1], scale)))
+
+    def preload(self, scale=None):
+        scale = scale or self.scale
+        for size in (20, 23, 15):
+            self._font(size, scale)
+        self._image('avatar', (65, 65), scale)
+        self._image('verif', (23, 23), scale)
+        self._image('love', (27, 27), scale)
+        self._image('send', (27, 27), scale)
+        self._image('save', (20, 20), scale)
+
+    def render(self, title, username=DEFAULT_USERNAME, love_count="99+", send_count="99+", save_count="9999+", template="label_1", scale=None):
+        """Return the label as a read-only (height, width, 4) uint8 array."""
+        scale = scale or self.scale
+        key = (template, title, username, love_count, send_count, save_count, scale)
+        with self._lock:
+            pixels = self._labels.get(key)
+            if pixels is not None:
+                self._labels.move_to_end(key)
+                self.hits += 1
+                return pixels
+            self.misses += 1
+
+        with self._draw_lock:
+            canvas = self._draw(title, username, love_count, send_count, save_count, scale)
+        pixels = np.asarray(canvas.convert("RGBA"))
+        # Every job in the process shares the array
+        pixels.flags.writeable = False
+
+        with self._lock:
+            self._labels[key] = pixels
+            if len(self._labels) > self.cache_size:
+                self._labels.popitem(last=False)
+        return pixels
+
+    def _draw(self, title, username, love_count, send_count, save_count, scale):
+        def at(x, y):
+            return (round(x * scale), round(y * scale))
+
+        username_font = self._font(20, scale)
+        title_font = self._font(23, scale)
+        small_font = self._font(15, scale)
+
+        # === Create white canvas ===
+        canvas = Image.new('RGB', at(660, 220), 'white')
+        draw = ImageDraw.Draw(canvas)
+
+        # === Paste the avatar image ===
+        avatar_img = self._image('avatar', (65, 65), scale)
+        canvas.paste(avatar_img, at(15, 11), avatar_img)
+
+        # === Draw username text ===
+        draw.text(at(87, 20), username, font=username_font, fill='black')
+        verif_img = self._image('verif', (23, 23), scale)
+        bbox = draw.textbbox((0, 0), username, font=username_font)
+        text_width = bbox[2] - bbox[0]
+        verif_x, verif_y = at(87, 22)
+        canvas.paste(verif_img, (verif_x + text_width + _scaled(2, scale), verif_y), verif_img)
+
+        # === Draw title text ===
+        draw.text(at(25, 100), title, font=title_font, fill='black')
+
+        # === Draw love and count text ===
+        love_img = self._image('love', (27, 27), scale)
+        canvas.paste(love_img, at(25, 175), love_img)
+        draw.text(at(58, 180), love_count, font=small_font, fill='#969696')
+
+        # === Draw send and count text ===
+        send_img = self._image('send', (27, 27), scale)
+        canvas.paste(send_img, at(96, 175), send_img)
+        draw.text(at(128, 180), send_count, font=small_font, fill='#969696')
+
+        # === Draw save and count text ===
+        save_img = self._image('save', (20, 20), scale)
+        canvas.paste(save_img, at(88, 46), save_img)
+        draw.text(at(112, 47), save_count, font=small_font, fill='#969696')
+        return canvas
+
+# Shared by every render in the process
+label_renderer = LabelRenderer()
+
+def preload_label_assets():
+    label_renderer.preload()
+
+def generate_label_image(label_id, title, username=DEFAULT_USERNAME, love_count="99+", send_count="99+", save_count="9999+", output_path=None):
+    """Write the label at full size to a PNG, for previewing a layout outside a render."""
+    if not output_path:
+        output_path = f'labels/outputs/{label_id}.png'
+    pixels = label_renderer.render(title or DEFAULT_TITLE, username or DEFAULT_USERNAME,
+                                   love_count, send_count, save_count, template=label_id, scale=1)
+    Image.fromarray(pixels).save(output_path)
 
-def generate_label_image(label_id, title, username="@storiesbyjt", love_count="99+", send_count="99+", save_count="9999+"):
-    # === Config ===
-    canvas_width, canvas_height = 660, 220
-    output_path = f'labels/outputs/{label_id}.png'
-    avatar_img_path = 'labels/preset/avatar.png'
-    save_img_path = 'labels/preset/save.png'
-    love_img_path = 'labels/preset/love.png'
-    send_img_path = 'labels/preset/send.png'
-    verif_img_path = 'labels/preset/verif.png'
-    
-    username_font = ImageFont.truetype('labels/preset/bold.otf', 20)
-    title_font = ImageFont.truetype('labels/preset/bold.otf', 23)
-    small_font = ImageFont.truetype('labels/preset/bold.otf', 15)
-
-    if not username:
-        username = '@storiesbyjt'
-    if not title:
-        title = 'The Craigslist Ad That Shook Me For The Rest Of My Life...'
-    
-    # === Create white canvas ===
-    canvas = Image.new('RGB', (canvas_width, canvas_height), 'white')
-    draw = ImageDraw.Draw(canvas)
-
-    # === Load and paste the avatar image ===
-    avatar_img = Image.open(avatar_img_path).convert("RGBA")
-    avatar_img = avatar_img.resize((65, 65))
-    canvas.paste(avatar_img, (15, 11), avatar_img)  
-    
-    # === Draw username text ===
-    draw.text((87, 20), username, font=username_font, fill='black', width=1)
-    verif_img = Image.open(verif_img_path).convert("RGBA")
-    verif_img = verif_img.resize((23, 23))
-    bbox = draw.textbbox((0, 0), username, font=username_font)
-    text_width = bbox[2] - bbox[0]
-    canvas.paste(verif_img, (87 + text_width + 2, 22), verif_img)   
-    
-    # === Draw title text ===
-    draw.text((25, 100), title, font=title_font, fill='black')
-    
-    # === Draw love and count text ===
-    love_img = Image.open(love_img_path).convert("RGBA")
-    love_img = love_img.resize((27, 27))
-    canvas.paste(love_img, (25, 175), love_img)
-    draw.text((58, 180), "99+", font=small_font, fill='#969696')
-    
-    # === Draw send and count text ===
-    send_img = Image.open(send_img_path).convert("RGBA")
-    send_img = send_img.resize((27, 27))
-    canvas.paste(send_img, (96, 175), send_img)
-    draw.text((128, 180), "99+", font=small_font, fill='#969696', width=1)
-    
-    # === Draw save and count text ===
-    save_img = Image.open(save_img_path).convert("RGBA")
-    save_img = save_img.resize((20, 20))
-    canvas.paste(save_img, (88, 46), save_img)
-    draw.text((112, 47), "9999+", font=small_font, fill='#969696')
-    
-    # === Save the final image ===
-    canvas.save(output_path)
-    
     print(f"✅ Saved as {output_path}")
-    
-    
+    return output_path
+
+
 if __name__ == "__main__":
-    generate_label_image(1, "@storiesbyjt", "The Craigslist Ad That Shook Me For The Rest Of My Life...")
-    
-    
\ No newline at end of file
+    generate_label_image(1, "The Craigslist Ad That Shook Me For The Rest Of My Life...")
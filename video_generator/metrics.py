@@ -0,0 +1,232 @@
+from contextlib import contextmanager
+import threading
+import time
+import os
+
+# Spans are collected into the recorder of the job running in this process
+_recorder = None
+_recorder_lock = threading.Lock()
+
+WALL_TIME_BUCKETS = [0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+CPU_TIME_BUCKETS = WALL_TIME_BUCKETS
+RSS_BUCKETS = [2**27, 2**28, 2**29, 2**30, 2**31, 2**32, 2**33]  # 128MB to 8GB
+BYTES_WRITTEN_BUCKETS = [2**16, 2**20, 2**22, 2**24, 2**26, 2**28, 2**30]  # 64KB to 1GB
+
+# How often the memory of the process tree is sampled while a span is open
+RSS_SAMPLE_INTERVAL = 0.05
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def _cpu_time():
+    # The calling thread's own CPU time, so a stage running next to another
+    # thread (single-pass transcription) isn't charged for it. Child processes
+    # such as the ffmpeg encoders are counted once they have been waited for;
+    # that part is process-wide.
+    times = os.times()
+    return time.thread_time() + times.children_user + times.children_system
+
+def _io_bytes_written():
+    # Per thread for the same reason as _cpu_time
+    try:
+        with open("/proc/thread-self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def _rss(pid):
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+def _child_pids(pid):
+    pids = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children", "r") as f:
+                pids.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return pids
+
+def _tree_rss():
+    """Resident memory of this process and every process it started, such as ffmpeg and slice workers."""
+    total = 0
+    pending = [os.getpid()]
+    while pending:
+        pid = pending.pop()
+        total += _rss(pid)
+        pending.extend(_child_pids(pid))
+    return total
+
+class PeakSampler:
+    """Tracks the peak tree RSS of every open span with one background thread.
+
+    ru_maxrss is a lifetime high-water mark, so in a reused worker every
+    stage after the biggest one would report its peak. Sampling gives each
+    span the peak of its own interval, nested and concurrent spans included.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._peaks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        token = object()
+        sample = _tree_rss()
+        with self._lock:
+            self._peaks[token] = sample
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+        return token
+
+    def stop(self, token):
+        sample = _tree_rss()
+        with self._lock:
+            return max(self._peaks.pop(token), sample)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            sample = _tree_rss()
+            with self._lock:
+                if not self._peaks:
+                    self._thread = None
+                    return
+                for token, peak in self._peaks.items():
+                    self._peaks[token] = max(peak, sample)
+
+    def _reset(self):
+        # A forked child has no sampler thread and none of the parent's spans
+        self._lock = threading.Lock()
+        self._peaks = {}
+        self._thread = None
+
+_peak_sampler = PeakSampler()
+os.register_at_fork(after_in_child=_peak_sampler._reset)
+
+class SpanRecorder:
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_list(self):
+        with self._lock:
+            return list(self.spans)
+
+@contextmanager
+def recording():
+    """Collect every span finished in this process until the block exits."""
+    global _recorder
+    recorder = SpanRecorder()
+    with _recorder_lock:
+        previous_recorder = _recorder
+        _recorder = recorder
+    try:
+        yield recorder
+    finally:
+        with _recorder_lock:
+            _recorder = previous_recorder
+
+@contextmanager
+def span(name, output_path=None):
+    """Time a pipeline stage.
+
+    Records wall time, CPU time, peak RSS and bytes written. CPU time and
+    bytes written are the calling thread's plus finished child processes;
+    the peak RSS is sampled over the whole process tree during the span.
+    When the stage produces a file (possibly through an ffmpeg subprocess)
+    pass it as output_path and its size is used as the bytes written.
+    """
+    start_wall = time.perf_counter()
+    start_cpu = _cpu_time()
+    start_io = _io_bytes_written()
+    sampler_token = _peak_sampler.start()
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - start_wall
+        peak_rss = _peak_sampler.stop(sampler_token)
+        if output_path and os.path.exists(output_path):
+            bytes_written = os.path.getsize(output_path)
+        else:
+            bytes_written = _io_bytes_written() - start_io
+
+        result = {
+            "stage": name,
+            "wall_time": round(wall_time, 3),
+            "cpu_time": round(_cpu_time() - start_cpu, 3),
+            "peak_rss": peak_rss,
+            "bytes_written": bytes_written
+        }
+        print(f"{name} took {wall_time:.2f} seconds")
+
+        recorder = _recorder
+        if recorder is not None:
+            recorder.add(result)
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # stage -> (bucket counts, sum, count)
+        self._series = {}
+
+    def observe(self, stage, value):
+        counts, total, count = self._series.get(stage, ([0] * len(self.buckets), 0, 0))
+        counts = [bucket_count + (1 if value <= bound else 0) for bucket_count, bound in zip(counts, self.buckets)]
+        self._series[stage] = (counts, total + value, count + 1)
+
+    def to_prometheus(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for stage, (counts, total, count) in sorted(self._series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{self.name}_count{{stage="{stage}"}} {count}')
+        return lines
+
+class MetricsRegistry:
+    """Aggregates the spans of finished jobs for the /metrics endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs_total = {}
+        self._histograms = {
+            "wall_time": Histogram("render_stage_wall_seconds", "Wall time per render stage", WALL_TIME_BUCKETS),
+            "cpu_time": Histogram("render_stage_cpu_seconds",
+                "CPU time of the thread running a render stage, plus child processes such as ffmpeg that finished during it (process-wide)",
+                CPU_TIME_BUCKETS),
+            "peak_rss": Histogram("render_stage_peak_rss_bytes",
+                "Peak resident memory of the render process and its children, sampled during the stage", RSS_BUCKETS),
+            "bytes_written": Histogram("render_stage_bytes_written",
+                "Size of the file a render stage produced, or bytes written by the thread running it", BYTES_WRITTEN_BUCKETS)
+        }
+
+    def observe_job(self, status, spans):
+        with self._lock:
+            self._jobs_total[status] = self._jobs_total.get(status, 0) + 1
+            for stage_span in spans:
+                for key, histogram in self._histograms.items():
+                    histogram.observe(stage_span["stage"], stage_span[key])
+
+    def to_prometheus(self):
+        with self._lock:
+            lines = ["# HELP render_jobs_total Finished render jobs by status", "# TYPE render_jobs_total counter"]
+            for status, count in sorted(self._jobs_total.items()):
+                lines.append(f'render_jobs_total{{status="{status}"}} {count}')
+            for histogram in self._histograms.values():
+                lines.extend(histogram.to_prometheus())
+        return "\n".join(lines) + "\n"
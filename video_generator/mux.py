@@ -0,0 +1,49 @@
+import subprocess
+import os
+
+import imageio_ffmpeg
+
+from config import PREVIEW_RENDITION
+
+def _temp_path(output_path):
+    # Written under a hidden name and renamed, so /get_video never serves a partial file
+    return os.path.join(os.path.dirname(output_path), f".{os.path.basename(output_path)}")
+
+def preview_path(video_path):
+    root, ext = os.path.splitext(video_path)
+    return f"{root}_preview{ext}"
+
+def mux_audio(video_path, audio_path, output_path, audio_bitrate="192k"):
+    """Copy the video stream and encode the PCM soundtrack to AAC, the only lossy audio step of a render.
+
+    The moov atom is moved to the front so players can start and seek
+    before the whole file has been downloaded.
+    """
+    temp_path = _temp_path(output_path)
+    subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-y",
+         "-i", video_path, "-i", audio_path,
+         "-map", "0:v:0", "-map", "1:a:0",
+         "-c:v", "copy", "-c:a", "aac", "-b:a", audio_bitrate,
+         "-shortest", "-movflags", "+faststart", "-f", "mp4", temp_path],
+        check=True
+    )
+    os.replace(temp_path, output_path)
+    print(f"Muxed {audio_path} into {output_path}")
+    return output_path
+
+def encode_preview(video_path, output_path=None, rendition=PREVIEW_RENDITION, threads=None):
+    """Write a smaller, lower bitrate fast-start copy of a finished video for reviewing."""
+    output_path = output_path or preview_path(video_path)
+    temp_path = _temp_path(output_path)
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-y",
+               "-i", video_path, "-vf", f"scale=-2:{rendition['height']}",
+               "-c:v", "libx264", "-preset", "veryfast", "-b:v", rendition["video_bitrate"],
+               "-maxrate", rendition["video_bitrate"], "-bufsize", rendition["video_bitrate"], "-pix_fmt", "yuv420p",
+               "-c:a", "aac", "-b:a", rendition["audio_bitrate"], "-movflags", "+faststart"]
+    if threads:
+        command += ["-threads", str(threads)]
+    subprocess.run(command + ["-f", "mp4", temp_path], check=True)
+    os.replace(temp_path, output_path)
+    print(f"Saved preview rendition to {output_path}")
+    return output_path
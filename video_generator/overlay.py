@@ -0,0 +1,119 @@
+import bisect
+
+import numpy as np
+
+def _resolve_axis(value, frame_length, overlay_length, relative):
+    if value in ("center", None):
+        return (frame_length - overlay_length) // 2
+    if value in ("left", "top"):
+        return 0
+    if value in ("right", "bottom"):
+        return frame_length - overlay_length
+    if relative:
+        return int(value * frame_length)
+    return int(value)
+
+def resolve_position(position, frame_size, overlay_size, relative=True):
+    """Turn a moviepy-style position into the top-left pixel of the overlay."""
+    frame_width, frame_height = frame_size
+    overlay_width, overlay_height = overlay_size
+    if isinstance(position, str) or position is None:
+        if position in ("left", "right"):
+            position = (position, "center")
+        elif position in ("top", "bottom"):
+            position = ("center", position)
+        else:
+            position = ("center", "center")
+    x, y = position
+    return (
+        _resolve_axis(x, frame_width, overlay_width, relative),
+        _resolve_axis(y, frame_height, overlay_height, relative)
+    )
+
+class Bitmap:
+    """A pre-rendered RGBA image stored in the form the blend needs.
+
+    alpha can be a float mask in [0, 1] or uint8. offset is where the image
+    sits inside the box it was laid out in, so cropped bitmaps keep their
+    placement, and box_size is that box's (width, height), by default the
+    image's own size.
+    """
+
+    def __init__(self, rgb, alpha, offset=(0, 0), box_size=None):
+        if alpha.dtype != np.uint8:
+            alpha = np.rint(alpha * 255).astype(np.uint8)
+        alpha = alpha.astype(np.uint16)[:, :, None]
+        # Premultiplied in 0..255*255 fixed point so a blend is one integer multiply-add per pixel
+        self.premultiplied = rgb[:, :, :3].astype(np.uint16) * alpha
+        self.inverse_alpha = 255 - alpha
+        self.offset = offset
+        self.box_size = box_size or (rgb.shape[1], rgb.shape[0])
+        # Work buffer for blends, allocated on first use and reused for every frame
+        self._scratch = None
+
+    @property
+    def size(self):
+        return self.premultiplied.shape[1], self.premultiplied.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.premultiplied.nbytes + self.inverse_alpha.nbytes
+
+    def blend_into(self, frame, position):
+        """Alpha-blend onto frame in place, touching only the bitmap's region."""
+        x, y = position[0] + self.offset[0], position[1] + self.offset[1]
+        frame_height, frame_width = frame.shape[:2]
+        width, height = self.size
+
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, frame_width), min(y + height, frame_height)
+        if x0 >= x1 or y0 >= y1:
+            return frame
+
+        if self._scratch is None:
+            self._scratch = np.empty_like(self.premultiplied)
+        region = frame[y0:y1, x0:x1]
+        ox, oy = x0 - x, y0 - y
+        blended = self._scratch[:y1 - y0, :x1 - x0]
+        np.multiply(region, self.inverse_alpha[oy:oy + y1 - y0, ox:ox + x1 - x0], out=blended)
+        blended += self.premultiplied[oy:oy + y1 - y0, ox:ox + x1 - x0]
+        blended //= 255
+        region[:] = blended
+        return frame
+
+class Overlay:
+    """A bitmap shown at a fixed position between start and end."""
+
+    def __init__(self, bitmap, start, end, position=(0, 0)):
+        self.bitmap = bitmap
+        self.start = start
+        self.end = end
+        self.position = position
+
+    def blend_into(self, frame):
+        return self.bitmap.blend_into(frame, self.position)
+
+class IntervalOverlay:
+    """Blends at most one timed overlay per frame, found by binary search over the start times."""
+
+    def __init__(self, overlays):
+        self.overlays = sorted(overlays, key=lambda overlay: overlay.start)
+        self._starts = [overlay.start for overlay in self.overlays]
+
+    def active_at(self, t):
+        i = bisect.bisect_right(self._starts, t) - 1
+        if i < 0 or t >= self.overlays[i].end:
+            return None
+        return self.overlays[i]
+
+    def apply(self, get_frame, t):
+        return self.blend_at(get_frame(t), t)
+
+    def blend_at(self, frame, t):
+        """Blend the overlay active at t onto frame, for callers whose frame time differs from t."""
+        overlay = self.active_at(t)
+        if overlay is None:
+            return frame
+        if not frame.flags.writeable:
+            frame = frame.copy()
+        return overlay.blend_into(frame)
@@ -0,0 +1,54 @@
+import subprocess
+import struct
+import os
+
+import numpy as np
+import imageio_ffmpeg
+
+SAMPLE_RATE = 44100
+
+def decode_audio(path, sample_rate=SAMPLE_RATE, channels=1):
+    """Decode any audio file ffmpeg can read into float32 samples shaped (n, channels)."""
+    result = subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-i", path,
+         "-f", "f32le", "-ar", str(sample_rate), "-ac", str(channels), "-"],
+        capture_output=True,
+        check=True
+    )
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, channels)
+
+def fade_edges(samples, fade_samples):
+    """Short linear fades at both ends so joined segments don't click."""
+    fade_samples = min(fade_samples, len(samples) // 2)
+    if fade_samples == 0:
+        return samples
+    samples = samples.copy()
+    ramp = np.linspace(0, 1, fade_samples, dtype=np.float32)[:, None]
+    samples[:fade_samples] *= ramp
+    samples[-fade_samples:] *= ramp[::-1]
+    return samples
+
+def active_rms(samples, frame_length=1024, threshold=0.1):
+    """RMS of the frames that carry speech, ignoring the silences around it."""
+    n_frames = len(samples) // frame_length
+    if n_frames == 0:
+        return float(np.sqrt(np.mean(samples ** 2))) if len(samples) else 0.0
+    frames = samples[:n_frames * frame_length].reshape(n_frames, -1)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    active = rms[rms > rms.max() * threshold]
+    return float(np.sqrt(np.mean(active ** 2))) if len(active) else 0.0
+
+def write_wav(samples, path, sample_rate=SAMPLE_RATE):
+    """Write float samples shaped (n, channels) as 16-bit PCM WAV without spawning ffmpeg."""
+    samples = samples.reshape(len(samples), -1)
+    channels = samples.shape[1]
+    data = np.clip(samples * 32767, -32768, 32767).astype("<i2")
+    header = b"".join([
+        b"RIFF", struct.pack("<I", 36 + data.nbytes), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, sample_rate * channels * 2, channels * 2, 16),
+        b"data", struct.pack("<I", data.nbytes)
+    ])
+    with open(path, "wb") as f:
+        f.write(header)
+        data.tofile(f)
+    return path
@@ -0,0 +1,253 @@
+from functools import lru_cache
+import subprocess
+import struct
+import re
+import os
+
+import imageio_ffmpeg
+
+# Containers whose headers are parsed here; anything else goes through ffmpeg
+MP4_EXTENSIONS = (".mp4", ".m4a", ".m4v", ".mov")
+
+_MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+}
+_MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG 1
+    2: [22050, 24000, 16000],  # MPEG 2
+    0: [11025, 12000, 8000]    # MPEG 2.5
+}
+
+# Sample entry fourccs under the names ffmpeg reports
+_MP4_CODECS = {
+    "avc1": "h264", "avc3": "h264", "hvc1": "hevc", "hev1": "hevc",
+    "av01": "av1", "vp09": "vp9", "mp4a": "aac", "Opus": "opus"
+}
+
+class ProbeError(Exception):
+    pass
+
+def _empty_info():
+    return {
+        "duration": None, "width": None, "height": None, "fps": None,
+        "video_codec": None, "audio_codec": None, "sample_rate": None, "channels": None
+    }
+
+def _iter_boxes(data, start=0, end=None):
+    end = len(data) if end is None else end
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[position:position + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[position + 8:position + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header:
+            break
+        yield box_type, position + header, position + size
+        position += size
+
+def _find_box(data, path, start=0, end=None):
+    for box_type, body_start, body_end in _iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return body_start, body_end
+            return _find_box(data, path[1:], body_start, body_end)
+    return None
+
+def _read_moov(f, file_size):
+    # moov can sit after a huge mdat, so only box headers are read on the way to it
+    position = 0
+    while position + 8 <= file_size:
+        f.seek(position)
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+        elif size == 0:
+            size = file_size - position
+        if size < 8:
+            break
+        if box_type == b"moov":
+            f.seek(position)
+            return f.read(size)
+        position += size
+    raise ProbeError("no moov box")
+
+def _probe_mp4(path):
+    with open(path, "rb") as f:
+        moov = _read_moov(f, os.fstat(f.fileno()).st_size)
+
+    info = _empty_info()
+    # The moov box's own header is the first 8 bytes of what was read
+    mvhd = _find_box(moov, [b"moov", b"mvhd"])
+    if mvhd:
+        body = moov[mvhd[0]:mvhd[1]]
+        if body[0] == 1:
+            timescale, duration = struct.unpack(">IQ", body[20:32])
+        else:
+            timescale, duration = struct.unpack(">II", body[12:20])
+        if timescale:
+            info["duration"] = duration / timescale
+
+    moov_body = _find_box(moov, [b"moov"])
+    for box_type, trak_start, trak_end in _iter_boxes(moov, *moov_body):
+        if box_type != b"trak":
+            continue
+        hdlr = _find_box(moov, [b"mdia", b"hdlr"], trak_start, trak_end)
+        mdhd = _find_box(moov, [b"mdia", b"mdhd"], trak_start, trak_end)
+        stsd = _find_box(moov, [b"mdia", b"minf", b"stbl", b"stsd"], trak_start, trak_end)
+        if not hdlr or not stsd:
+            continue
+        handler = moov[hdlr[0] + 8:hdlr[0] + 12]
+        entry = stsd[0] + 8
+        codec = moov[entry + 4:entry + 8].decode("latin-1").strip()
+        codec = _MP4_CODECS.get(codec, codec)
+
+        if handler == b"vide":
+            info["video_codec"] = codec
+            info["width"], info["height"] = struct.unpack(">HH", moov[entry + 32:entry + 36])
+            stts = _find_box(moov, [b"mdia", b"minf", b"stbl", b"stts"], trak_start, trak_end)
+            if mdhd and stts:
+                body = moov[mdhd[0]:mdhd[1]]
+                timescale = struct.unpack(">I", body[20:24] if body[0] == 1 else body[12:16])[0]
+                count = struct.unpack(">I", moov[stts[0] + 4:stts[0] + 8])[0]
+                frames = ticks = 0
+                for i in range(count):
+                    sample_count, delta = struct.unpack(">II", moov[stts[0] + 8 + i * 8:stts[0] + 16 + i * 8])
+                    frames += sample_count
+                    ticks += sample_count * delta
+                if ticks:
+                    info["fps"] = round(frames * timescale / ticks, 3)
+        elif handler == b"soun":
+            info["audio_codec"] = codec
+            info["channels"] = struct.unpack(">H", moov[entry + 24:entry + 26])[0]
+            info["sample_rate"] = struct.unpack(">I", moov[entry + 32:entry + 36])[0] >> 16
+    return info
+
+def _probe_wav(path):
+    with open(path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ProbeError("not a WAV file")
+        info = _empty_info()
+        block_align = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ProbeError("no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+            if chunk_id == b"fmt ":
+                audio_format, info["channels"], info["sample_rate"], _, block_align, bits = struct.unpack("<HHIIHH", f.read(16))
+                info["audio_codec"] = f"pcm_s{bits}le" if audio_format == 1 else "pcm_f32le" if audio_format == 3 else "pcm"
+                f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if not block_align:
+                    raise ProbeError("data before fmt")
+                info["duration"] = chunk_size / block_align / info["sample_rate"]
+                return info
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+def _probe_mp3(path):
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        head = f.read(64 * 1024)
+
+    offset = 0
+    if head[:3] == b"ID3":
+        # The tag size is stored as a synchsafe integer
+        size = 0
+        for byte in head[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        offset = 10 + size
+        with open(path, "rb") as f:
+            f.seek(offset)
+            head = f.read(64 * 1024)
+
+    for i in range(len(head) - 4):
+        if head[i] == 0xFF and head[i + 1] & 0xE0 == 0xE0:
+            version_bits = (head[i + 1] >> 3) & 0x3
+            layer_bits = (head[i + 1] >> 1) & 0x3
+            bitrate_index = head[i + 2] >> 4
+            rate_index = (head[i + 2] >> 2) & 0x3
+            if version_bits == 1 or layer_bits != 1 or bitrate_index in (0, 15) or rate_index == 3:
+                continue
+            break
+    else:
+        raise ProbeError("no mp3 frame found")
+
+    mpeg1 = version_bits == 3
+    sample_rate = _MP3_SAMPLE_RATES[version_bits][rate_index]
+    bitrate = _MP3_BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+    channels = 1 if head[i + 3] >> 6 == 3 else 2
+    samples_per_frame = 1152 if mpeg1 else 576
+
+    info = _empty_info()
+    info.update(audio_codec="mp3", sample_rate=sample_rate, channels=channels)
+
+    # A Xing/Info header in the first frame gives the exact frame count
+    side_info = (32 if channels == 2 else 17) if mpeg1 else (17 if channels == 2 else 9)
+    tag = i + 4 + side_info
+    if head[tag:tag + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", head[tag + 4:tag + 8])[0]
+        if flags & 0x1:
+            frames = struct.unpack(">I", head[tag + 8:tag + 12])[0]
+            info["duration"] = frames * samples_per_frame / sample_rate
+            return info
+
+    info["duration"] = (file_size - offset - i) * 8 / bitrate
+    return info
+
+def _probe_ffmpeg(path):
+    # Slow path: ffmpeg prints the stream layout when given an input and no output
+    result = subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-i", path],
+                            capture_output=True, text=True)
+    output = result.stderr
+    info = _empty_info()
+    duration = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", output)
+    if not duration:
+        raise ProbeError(f"ffmpeg could not read {path}")
+    hours, minutes, seconds = duration.groups()
+    info["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    video = re.search(r"Stream #.*?Video: (\w+).*?, (\d+)x(\d+)", output)
+    if video:
+        info["video_codec"] = video.group(1)
+        info["width"], info["height"] = int(video.group(2)), int(video.group(3))
+        fps = re.search(r"([\d.]+) fps", output)
+        if fps:
+            info["fps"] = float(fps.group(1))
+    audio = re.search(r"Stream #.*?Audio: (\w+).*?(\d+) Hz, (mono|stereo)?", output)
+    if audio:
+        info["audio_codec"] = audio.group(1)
+        info["sample_rate"] = int(audio.group(2))
+        info["channels"] = {"mono": 1, "stereo": 2}.get(audio.group(3))
+    return info
+
+@lru_cache(maxsize=4096)
+def _probe_cached(path, mtime_ns, size):
+    extension = os.path.splitext(path)[1].lower()
+    parsers = {".wav": _probe_wav, ".mp3": _probe_mp3}
+    parser = _probe_mp4 if extension in MP4_EXTENSIONS else parsers.get(extension)
+    if parser is not None:
+        try:
+            return parser(path)
+        except (ProbeError, struct.error, IndexError, KeyError) as e:
+            print(f"Header probe failed for {path} ({e}), asking ffmpeg")
+    return _probe_ffmpeg(path)
+
+def probe(path):
+    """Duration, resolution, fps, codecs, sample rate and channels of a media file.
+
+    Read from the container headers without starting a decoder. Results are
+    cached per (path, mtime, size), so a file that changes is probed again.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return dict(_probe_cached(path, stat.st_mtime_ns, stat.st_size))
+
+def probe_duration(path):
+    return probe(path)["duration"]
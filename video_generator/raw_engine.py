@@ -0,0 +1,118 @@
+import subprocess
+import math
+
+import numpy as np
+import imageio_ffmpeg
+
+from video_generator.overlay import Bitmap, resolve_position
+
+# A segment may come up this much short of its planned length (container durations
+# round), beyond that the clip is treated as broken
+MAX_MISSING_SECONDS = 0.5
+
+def load_label_bitmap(label, frame_size):
+    """The label image centered on the frame, it is already at its on-screen size."""
+    pixels = label["image"]
+    bitmap = Bitmap(pixels[:, :, :3], pixels[:, :, 3])
+    return bitmap, resolve_position("center", frame_size, bitmap.size)
+
+def segment_frames(segments, fps, first_frame, last_frame):
+    """Yield (segment, first, last, offset) for the frames of [first_frame, last_frame) each segment shows."""
+    offset = 0
+    for segment in segments:
+        length = segment["end"] - segment["start"]
+        # Frame f shows the segment that covers time f / fps
+        segment_first = max(first_frame, math.ceil(offset * fps - 1e-6))
+        segment_last = min(last_frame, math.ceil((offset + length) * fps - 1e-6))
+        if segment_first < segment_last:
+            yield segment, segment_first, segment_last, offset
+        offset += length
+
+def _read_into(stream, view):
+    """Fill view from stream, False if the stream ended before it was full."""
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            return False
+        filled += count
+    return True
+
+def _open_decoder(path, start, frames, fps, size):
+    width, height = size
+    return subprocess.Popen(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error",
+         "-ss", f"{start:.6f}", "-i", path, "-an",
+         "-vf", f"fps={fps},scale={width}:{height}", "-frames:v", str(frames),
+         "-f", "rawvideo", "-pix_fmt", "rgb24", "-"],
+        stdout=subprocess.PIPE,
+        bufsize=0
+    )
+
+def render_timeline(timeline, output_path, fps=30, first_frame=0, last_frame=None, preset="ultrafast",
+        ffmpeg_params=("-crf", "28"), threads=None):
+    """Composite the timeline with ffmpeg pipes instead of moviepy's clip graph.
+
+    Each background segment is decoded by its own ffmpeg into a reused RGB
+    buffer, the label and captions are blended into their region in place,
+    and the frame is written straight to an x264 encoder pipe. Nothing is
+    allocated per frame. A decoder that fails, or ends well before its
+    segment does, fails the render instead of freezing the picture.
+    """
+    width, height = timeline.size
+    total_frames = int(timeline.duration * fps)
+    last_frame = total_frames if last_frame is None else last_frame
+
+    # Frames are read into incoming and swapped with decoded only when complete,
+    # so a short read never shows up as a half-updated frame
+    decoded = np.zeros((height, width, 3), dtype=np.uint8)
+    incoming = np.empty_like(decoded)
+    frame = np.empty_like(decoded)
+    decoded_view, incoming_view = memoryview(decoded).cast("B"), memoryview(incoming).cast("B")
+    frame_view = memoryview(frame).cast("B")
+
+    label_bitmap = label_position = None
+    if timeline.label:
+        label_bitmap, label_position = load_label_bitmap(timeline.label, timeline.size)
+    caption_layer = timeline.caption_layer
+
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-y",
+               "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+               "-an", "-c:v", "libx264", "-preset", preset, *ffmpeg_params, "-pix_fmt", "yuv420p"]
+    if threads:
+        command += ["-threads", str(threads)]
+    encoder = subprocess.Popen(command + [output_path], stdin=subprocess.PIPE)
+
+    try:
+        for segment, segment_first, segment_last, offset in segment_frames(timeline.segments, fps, first_frame, last_frame):
+            source_start = segment["start"] + segment_first / fps - offset
+            decoder = _open_decoder(segment["path"], source_start, segment_last - segment_first, fps, timeline.size)
+            frames_read = 0
+            try:
+                for frame_index in range(segment_first, segment_last):
+                    # A segment that ends a little early keeps showing its last complete frame
+                    if _read_into(decoder.stdout, incoming_view):
+                        decoded, incoming = incoming, decoded
+                        decoded_view, incoming_view = incoming_view, decoded_view
+                        frames_read += 1
+                    np.copyto(frame, decoded)
+                    t = frame_index / fps
+                    if label_bitmap is not None and t < timeline.label["duration"]:
+                        label_bitmap.blend_into(frame, label_position)
+                    if caption_layer is not None:
+                        caption_layer.blend_at(frame, t)
+                    encoder.stdin.write(frame_view)
+            finally:
+                decoder.stdout.close()
+                decoder.wait()
+            if decoder.returncode != 0:
+                raise RuntimeError(f"ffmpeg decoder exited with {decoder.returncode} for {segment['path']}")
+            missing = segment_last - segment_first - frames_read
+            if missing > MAX_MISSING_SECONDS * fps:
+                raise RuntimeError(f"{segment['path']} ended {missing} frames before its segment, the clip may be damaged")
+    finally:
+        encoder.stdin.close()
+        encoder.wait()
+    if encoder.returncode != 0:
+        raise RuntimeError(f"ffmpeg encoder exited with {encoder.returncode} for {output_path}")
+    return output_path
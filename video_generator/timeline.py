@@ -0,0 +1,145 @@
+from moviepy import VideoFileClip, ImageClip, CompositeVideoClip, concatenate_videoclips
+
+from video_generator.metrics import span
+from video_generator.raw_engine import render_timeline
+
+import concurrent.futures
+import subprocess
+import os
+
+import imageio_ffmpeg
+
+# How a timeline can be composited: moviepy's clip graph or raw_engine's ffmpeg pipes
+ENGINES = ("moviepy", "ffmpeg")
+
+class Timeline:
+    """What a render composites, as plain data that can be sent to another process.
+
+    segments are the background pieces in order ({"path", "start", "end"}),
+    label is the title image ({"image", "duration"}, an RGBA array at its final size),
+    caption_layer an IntervalOverlay and size the (width, height) of the
+    frame. Unless scale is 1 the backgrounds are decoded straight at size.
+    build() opens only the clips a time range needs, so every slice
+    of a sliced encode rebuilds just its part.
+    """
+
+    def __init__(self, segments, label=None, caption_layer=None, size=None, scale=1):
+        self.segments = segments
+        self.label = label
+        self.caption_layer = caption_layer
+        self.size = size
+        self.scale = scale
+
+    @property
+    def duration(self):
+        return sum(segment["end"] - segment["start"] for segment in self.segments)
+
+    def build(self, start=0, end=None):
+        end = self.duration if end is None else end
+        clips = []
+        offset = 0
+        for segment in self.segments:
+            length = segment["end"] - segment["start"]
+            clip_start, clip_end = max(start, offset), min(end, offset + length)
+            if clip_start < clip_end:
+                clip = VideoFileClip(segment["path"], target_resolution=self.size if self.scale != 1 else None)
+                source_start = segment["start"] + clip_start - offset
+                source_end = min(segment["start"] + clip_end - offset, clip.duration)
+                clips.append(clip.subclipped(source_start, source_end))
+            offset += length
+
+        video = concatenate_videoclips(clips) if len(clips) > 1 else clips[0]
+        if self.label and start < self.label["duration"]:
+            label_clip = ImageClip(
+                self.label["image"],
+                duration=min(self.label["duration"] - start, video.duration)
+            ).with_position("center")
+            video = CompositeVideoClip([video, label_clip])
+        if self.caption_layer is not None:
+            caption_layer = self.caption_layer
+            video = video.transform(lambda get_frame, t: caption_layer.blend_at(get_frame(t), t + start))
+        return video
+
+def _encode_range(timeline, first_frame, last_frame, output_path, fps, encoder_params, threads, engine="moviepy"):
+    # Runs in a worker process
+    if engine == "ffmpeg":
+        return render_timeline(timeline, output_path, fps, first_frame, last_frame,
+                               encoder_params["preset"], encoder_params["ffmpeg_params"], threads)
+
+    # The half frame makes moviepy's int(duration * fps) come out at exactly
+    # the slice's frame count despite float rounding
+    video = timeline.build(first_frame / fps, last_frame / fps)
+    video = video.with_duration((last_frame - first_frame + 0.5) / fps)
+    video.write_videofile(
+        output_path,
+        codec="libx264",
+        audio=False,
+        fps=fps,
+        threads=threads,
+        logger=None,
+        preset=encoder_params["preset"],
+        ffmpeg_params=encoder_params["ffmpeg_params"]
+    )
+    video.close()
+    return output_path
+
+def concat_copy(piece_paths, output_path):
+    """Join pieces encoded with identical settings without re-encoding them."""
+    list_path = f"{output_path}.txt"
+    with open(list_path, "w") as f:
+        for piece_path in piece_paths:
+            f.write(f"file '{os.path.abspath(piece_path)}'\n")
+    subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-y",
+         "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_path],
+        check=True
+    )
+    os.remove(list_path)
+    return output_path
+
+def encode_sliced(timeline, output_path, workers, temp_dir, fps=30, preset="ultrafast", crf=28, gop_seconds=1, total_threads=8, engine="moviepy", tune=None):
+    """Encode the timeline in workers time slices side by side and stream-copy them together.
+
+    Slices are cut on GOP boundaries and every slice is encoded with the same
+    fixed GOP and no scene-cut keyframes, so the joined stream looks like one
+    encode. Compositing runs in every worker instead of one Python thread.
+    engine picks how a slice is composited: "moviepy" or "ffmpeg" (raw_engine),
+    tune is an optional x264 -tune value.
+    """
+    gop = int(round(gop_seconds * fps))
+    total_frames = int(timeline.duration * fps)
+    total_gops = -(-total_frames // gop)
+    slice_count = max(1, min(workers, total_gops))
+    encoder_params = {
+        "preset": preset,
+        "ffmpeg_params": ["-crf", str(crf), "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0"]
+    }
+    if tune:
+        encoder_params["ffmpeg_params"] += ["-tune", tune]
+
+    boundaries = [min(total_frames, round(total_gops * i / slice_count) * gop) for i in range(slice_count + 1)]
+    ranges = [(first, last) for first, last in zip(boundaries, boundaries[1:]) if last > first]
+    threads = max(1, total_threads // len(ranges))
+    if len(ranges) == 1:
+        # Nothing to join, so encode in this process straight to the output
+        with span("sliced_encode", output_path=output_path):
+            return _encode_range(timeline, ranges[0][0], ranges[0][1], output_path, fps, encoder_params, threads, engine)
+
+    os.makedirs(temp_dir, exist_ok=True)
+    piece_paths = [os.path.join(temp_dir, f"slice_{i:03d}.mp4") for i in range(len(ranges))]
+    print(f"Encoding {total_frames} frames in {len(ranges)} slices with {threads} threads each")
+
+    with span("sliced_encode", output_path=output_path):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [
+                executor.submit(_encode_range, timeline, first, last, piece_path, fps, encoder_params, threads, engine)
+                for (first, last), piece_path in zip(ranges, piece_paths)
+            ]
+            for future in futures:
+                future.result()
+
+    with span("concat", output_path=output_path):
+        concat_copy(piece_paths, output_path)
+    for piece_path in piece_paths:
+        os.remove(piece_path)
+    return output_path
@@ -0,0 +1,115 @@
+from abc import ABC, abstractmethod
+import subprocess
+import os
+
+import imageio_ffmpeg
+
+from video_generator.metrics import span
+from video_generator.api_client import openai_client
+from video_generator.transcript_cache import transcript_cache
+
+# Accepted values of generate_video's timing_source
+TIMING_SOURCES = ("alignment", "whisper")
+
+def words_from_character_alignment(characters, start_times, end_times):
+    """Group a TTS character alignment into word timestamps."""
+    words = []
+    current_word = ""
+    word_start = word_end = None
+    for char, start, end in zip(characters, start_times, end_times):
+        if char.isspace():
+            if current_word:
+                words.append({"word": current_word, "start": word_start, "end": word_end})
+            current_word = ""
+            continue
+        if not current_word:
+            word_start = start
+        current_word += char
+        word_end = end
+    if current_word:
+        words.append({"word": current_word, "start": word_start, "end": word_end})
+    return words
+
+class TimingProvider(ABC):
+    """Supplies the word timestamps that captions are built from."""
+
+    name = "base"
+
+    @abstractmethod
+    def get_word_timestamps(self, audio_path):
+        """Return [{"word", "start", "end"}] in seconds from the start of audio_path."""
+
+class WhisperTimings(TimingProvider):
+    """Transcribes the mixed audio with Whisper, the fallback when no alignment is available."""
+
+    name = "whisper"
+
+    def __init__(self, model="whisper-1", cache=transcript_cache):
+        self.model = model
+        self.cache = cache
+
+    def get_word_timestamps(self, audio_path):
+        # Caption-only re-renders of the same audio are served from disk
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(audio_path, model=self.model, granularity="word")
+            timestamps = self.cache.get(cache_key)
+            if timestamps is not None:
+                print(f"Using cached transcript {cache_key[:12]} ({self.cache.stats()})")
+                return timestamps
+
+        with span("transcription"):
+            upload_path = self._upload_copy(audio_path)
+            # Read up front so a retried or hedged request can send the file again
+            with open(upload_path, "rb") as audio_file:
+                audio_bytes = audio_file.read()
+            transcript = openai_client().request(
+                "POST", "/v1/audio/transcriptions",
+                operation="transcription",
+                files={"file": (os.path.basename(upload_path), audio_bytes)},
+                data={
+                    "model": self.model,
+                    "response_format": "verbose_json",
+                    "timestamp_granularities[]": "word"
+                }
+            ).json()
+
+        timestamps = []
+        for word in transcript.get("words", []):
+            timestamps.append({
+                "word": word["word"],
+                "start": round(float(word["start"]), 2),
+                "end": round(float(word["end"]), 2)
+            })
+
+        if self.cache is not None:
+            self.cache.put(cache_key, timestamps)
+        return timestamps
+
+    def _upload_copy(self, audio_path):
+        # The job soundtrack is a PCM WAV; Whisper only needs a small mono mp3 of it
+        if not audio_path.endswith(".wav"):
+            return audio_path
+        upload_path = os.path.splitext(audio_path)[0] + "_whisper.mp3"
+        subprocess.run(
+            [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-y", "-i", audio_path,
+             "-ac", "1", "-ar", "16000", "-b:a", "48k", upload_path],
+            check=True
+        )
+        return upload_path
+
+class AlignmentTimings(TimingProvider):
+    """Uses the word alignment returned with the TTS audio, shifted to where the voice starts in the mix."""
+
+    name = "alignment"
+
+    def __init__(self, words, offset=0):
+        self.words = words
+        self.offset = offset
+
+    def get_word_timestamps(self, audio_path=None):
+        return [{
+            "word": word["word"],
+            "start": round(word["start"] + self.offset, 2),
+            "end": round(word["end"] + self.offset, 2)
+        } for word in self.words]
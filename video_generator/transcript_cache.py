@@ -0,0 +1,98 @@
+import hashlib
+import json
+import threading
+import os
+
+# Word timestamps of transcribed audio, keyed by the audio content
+TRANSCRIPT_CACHE_DIR = os.environ.get("TRANSCRIPT_CACHE_DIR", "temp/transcript_cache")
+TRANSCRIPT_CACHE_MAX_BYTES = 64 * 2**20
+
+class TranscriptCache:
+    """On-disk cache of Whisper word timestamps.
+
+    Entries are named by a sha256 of the audio bytes and the request
+    parameters, so a re-render of the same audio hits no matter which job
+    or file name produced it. A file's mtime is its last use, which gives
+    LRU eviction that every worker process agrees on.
+    """
+
+    def __init__(self, folder=TRANSCRIPT_CACHE_DIR, max_bytes=TRANSCRIPT_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+    def key(self, audio_path, **params):
+        digest = hashlib.sha256()
+        with open(audio_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return [
+            {"word": word, "start": start / 100, "end": end / 100}
+            for word, start, end in zip(entry["words"], entry["start"], entry["end"])
+        ]
+
+    def put(self, key, timestamps):
+        # Columns of centiseconds, about a third of the size of a list of dicts
+        entry = {
+            "words": [word["word"] for word in timestamps],
+            "start": [int(round(word["start"] * 100)) for word in timestamps],
+            "end": [int(round(word["end"] * 100)) for word in timestamps]
+        }
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(entry, f, separators=(",", ":"))
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.folder):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+                total -= size
+                print(f"Evicted transcript {name} from cache")
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+# Shared by every WhisperTimings in the process
+transcript_cache = TranscriptCache()
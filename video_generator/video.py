@@ -1,100 +1,109 @@
 from moviepy import VideoFileClip, concatenate_videoclips, ImageClip, CompositeVideoClip
 import os
-import random
-import time
 import concurrent.futures
-from functools import partial
 import multiprocessing
 
-from video_generator.label import generate_label_image
+from video_generator.label import label_renderer, LABEL_SCALE
+from video_generator.metrics import span
+from video_generator.backgrounds import BackgroundIndex, background_usage
+from video_generator.timeline import Timeline, encode_sliced
+from video_generator.probe import probe
+from video_generator.encoder_profiles import encoder_settings, x264_params
+
+def list_background_clips(background_folder, max_workers=4):
+    """List the clips of a background folder with their durations so several renders can share it.
+
+    Comes from the folder's persisted index, so only new or changed files are probed.
+    """
+    return BackgroundIndex(background_folder).refresh(max_workers)
+
+def scaled_size(size, scale):
+    """size scaled and rounded to even numbers, which yuv420p needs."""
+    return tuple(max(2, round(length * scale / 2) * 2) for length in size)
 
 class Video:
-    def __init__(self, video_output_path, audio=None, background_folder="assets/backgrounds/minecraft/parkour1/", length=10, parallel_processing=False, max_workers=4):
+    def __init__(self, video_output_path, audio=None, background_folder="assets/backgrounds/minecraft/parkour1/", length=10, parallel_processing=False, max_workers=4, background_clips=None, temp_dir="temp/video_processing", engine="moviepy", quality="final", encoder_profile=None):
         self.video_output_path = video_output_path
+        # "moviepy" builds a clip graph, "ffmpeg" only plans the timeline for raw_engine
+        self.engine = engine
+        # A QUALITY_LEVELS entry: the scale backgrounds are decoded at and the encoder
+        # settings, which a tuned encoder profile overrides
+        self.quality = encoder_settings(quality, encoder_profile, max_threads=max_workers)
+        self.background_video = None
+        self.label_image_clip = None
+        self.temp_dir = temp_dir
         self.clips = []
+        # Optional pre-scanned output of list_background_clips
+        self.background_clips = background_clips
+        self.label = None
         self.parallel_processing = parallel_processing
         self.max_workers = max_workers
         
-        if not audio.duration:
+        # audio only sets the length here, the soundtrack is muxed in after the encode
+        if audio is None or not audio.duration:
             self.length = length
         else:
             self.length = audio.duration
         print(f"length: {self.length}")
-        print(f"audio duration: {audio.duration}")
         self.background_folder = background_folder
         self.audio = audio
 
-        self._get_clips()
-        self._conconate_clips()
-        self._add_audio()
+        with span("background_load"):
+            self._get_clips()
+        if self.engine == "moviepy":
+            with span("concatenate"):
+                self._conconate_clips()
 
     @property
     def duration(self):
+        if self.background_video is None:
+            return sum(segment["end"] - segment["start"] for segment in self.segments)
         return self.background_video.duration
 
+    @property
+    def size(self):
+        if self.background_video is not None:
+            return tuple(self.background_video.size)
+        return scaled_size(self.source_size, self.quality["scale"])
+
+    @property
+    def source_size(self):
+        first_path = self.segments[0]["path"]
+        for clip_info in self.background_clips:
+            if clip_info["path"] == first_path and clip_info.get("width"):
+                return clip_info["width"], clip_info["height"]
+        info = probe(first_path)
+        return info["width"], info["height"]
+
     @property
     def video(self):
         return self.background_video
 
-    def _get_random_clip(self):
-        while True:
-            clip = random.choice(os.listdir(self.background_folder))
-            if clip not in self.clips and ".ds_store" not in clip.lower():
-                print(f"Got clip: {clip}")
-                return VideoFileClip(os.path.join(self.background_folder, clip))
-
     def _get_clips_duration(self):
         return sum([clip.duration for clip in self.clips])
 
-    def _load_clip(self, file_path):
-        try:
-            return VideoFileClip(file_path)
-        except Exception as e:
-            print(f"Error loading clip {file_path}: {e}")
-            return None
+    def _open_segment(self, segment):
+        # ffmpeg scales while decoding, so a draft never handles full size frames
+        target_resolution = self.size if self.quality["scale"] != 1 else None
+        clip = VideoFileClip(segment["path"], target_resolution=target_resolution)
+        end = min(segment["end"], clip.duration)
+        if segment["start"] > 0 or end < clip.duration:
+            clip = clip.subclipped(segment["start"], end)
+        return clip
 
     def _get_clips(self):
-        if self.parallel_processing:
-            # Get list of potential clips first
-            potential_clips = []
-            for file in os.listdir(self.background_folder):
-                if ".ds_store" not in file.lower():
-                    potential_clips.append(os.path.join(self.background_folder, file))
-            
-            random.shuffle(potential_clips)  # Randomize the order
-            
-            # Load clips in parallel
-            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                future_to_clip = {executor.submit(self._load_clip, clip_path): clip_path 
-                                 for clip_path in potential_clips[:10]}  # Start with first 10 clips
-                
-                for future in concurrent.futures.as_completed(future_to_clip):
-                    clip_path = future_to_clip[future]
-                    try:
-                        clip = future.result()
-                        if clip is not None:
-                            if self._get_clips_duration() + clip.duration > self.length:
-                                # Need to trim the clip
-                                self.clips.append(clip.subclipped(0, self.length - self._get_clips_duration()))
-                                break
-                            else:
-                                self.clips.append(clip)
-                                
-                            if self._get_clips_duration() >= self.length:
-                                break
-                    except Exception as e:
-                        print(f"Error processing clip {clip_path}: {e}")
-        else:
-            # Original sequential method
-            while (self._get_clips_duration() < self.length):
-                clip = self._get_random_clip()
-                print(clip.duration, self.length - self._get_clips_duration())
-                if clip.duration > self.length - self._get_clips_duration():
-                    self.clips.append(clip.subclipped(0, self.length - self._get_clips_duration()))
-                else:
-                    self.clips.append(clip)
-                    
-        print(f"Got clips for video with total duration {self._get_clips_duration()}")
+        if not self.background_clips:
+            self.background_clips = list_background_clips(self.background_folder, self.max_workers)
+
+        # The plan fixes which clips are used and in what order, so only those are opened
+        self.segments = background_usage.plan(self.background_clips, self.length)
+        if self.engine != "moviepy":
+            print(f"Planned {len(self.segments)} background segments for the {self.engine} engine")
+            return
+        max_workers = self.max_workers if self.parallel_processing else 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            self.clips = list(executor.map(self._open_segment, self.segments))
+        print(f"Got {len(self.clips)} clips for video with total duration {self._get_clips_duration()}")
 
     def _conconate_clips(self):
         # Use multiprocessing for faster concatenation if available
@@ -107,75 +116,89 @@ class Video:
             
         print(f"Concatenated clips for video with total duration {self.background_video.duration}")
 
-    def _add_audio(self):
-        self.background_video.audio = self.audio
-        print("Added audio to video")
-
     def add_label(self, label_name, title, duration):
-        generate_label_image(label_name, title)
-
-        self.label_image_clip = ImageClip(
-            f"labels/outputs/{label_name}.png", 
-            duration=duration
-        ).with_position("center").resized(0.8)
-
-        self.background_video = CompositeVideoClip([self.background_video, self.label_image_clip])
+        with span("label_render"):
+            # Drawn in memory at its on-screen size, so there is nothing to resize per frame
+            image = label_renderer.render(title, template=label_name, scale=LABEL_SCALE * self.quality["scale"])
+            self.label = {"image": image, "duration": duration}
+
+            if self.engine == "moviepy":
+                self.label_image_clip = ImageClip(
+                    image, 
+                    duration=duration
+                ).with_position("center")
+
+                self.background_video = CompositeVideoClip([self.background_video, self.label_image_clip])
         
         print("Added label to video")
 
-    def save_video(self):
+    def timeline(self):
+        """The background segments and label as plain data, for encoding in other processes."""
+        return Timeline(self.segments, label=self.label, size=self.size, scale=self.quality["scale"])
+
+    def save_video(self, encode_workers=1):
         # Ensure the output directory exists
         output_dir = os.path.dirname(self.video_output_path)
         if output_dir:
             os.makedirs(output_dir, exist_ok=True)
         
         # Create a dedicated temp dir for this specific operation
-        temp_dir = os.path.abspath("temp/video_processing")
+        temp_dir = os.path.abspath(self.temp_dir)
         os.makedirs(temp_dir, exist_ok=True)
         print(f"Using temp directory for video processing: {temp_dir}")
         
         # Use CPU count for optimal encoding performance
         cpu_count = multiprocessing.cpu_count()
-        optimal_threads = min(cpu_count, 8)  # Use up to 8 threads or available CPUs
+        optimal_threads = self.quality.get("threads") or min(cpu_count, 8)  # Use up to 8 threads or available CPUs
         
         # Optimize first-pass video encoding
         print(f"Starting initial video encoding with {optimal_threads} threads...")
-        start_time = time.time()
         
-        try:
-            # Use optimized encoding settings for faster generation
-            self.background_video.write_videofile(
-                self.video_output_path, 
-                audio_codec="aac",
-                fps=30,
-                threads=optimal_threads,  # Use multiple CPU cores for encoding
-                logger="bar",
-                temp_audiofile=os.path.join(temp_dir, "temp_audio.m4a"),
-                remove_temp=True,
-                preset="ultrafast",  # Use fastest preset
-                ffmpeg_params=["-crf", "28"]  # Reduce quality for speed
-            )
-            encoding_time = time.time() - start_time
-            print(f"First-pass video encoding completed in {encoding_time:.2f} seconds")
-        except Exception as e:
-            print(f"Error during first-pass encoding: {e}")
-            # Use fallback method with safer settings
-            print("Using fallback encoding method...")
-            self.background_video.write_videofile(
-                self.video_output_path, 
-                audio_codec="aac",
-                fps=30,
-                threads=optimal_threads,
-                logger="bar"
-            )
+        if encode_workers > 1 or self.engine != "moviepy":
+            with span("first_encode", output_path=self.video_output_path):
+                encode_sliced(self.timeline(), self.video_output_path, encode_workers,
+                              os.path.join(temp_dir, "slices"), fps=self.quality["fps"], preset=self.quality["preset"],
+                              crf=self.quality["crf"], gop_seconds=self.quality.get("gop_seconds", 1), tune=self.quality.get("tune"),
+                              total_threads=self.quality.get("threads") or cpu_count, engine=self.engine)
+            print(f"Saved video to {self.video_output_path}")
+            return
+
+        with span("first_encode", output_path=self.video_output_path):
+            try:
+                # Use optimized encoding settings for faster generation
+                # Video only, the audio is encoded once when the final video is muxed
+                self.background_video.write_videofile(
+                    self.video_output_path, 
+                    audio=False,
+                    fps=self.quality["fps"],
+                    threads=optimal_threads,  # Use multiple CPU cores for encoding
+                    logger="bar",
+                    preset=self.quality["preset"],
+                    ffmpeg_params=x264_params(self.quality, self.quality["fps"])
+                )
+            except Exception as e:
+                print(f"Error during first-pass encoding: {e}")
+                # Fall back without the tune and GOP flags, keeping the preset and CRF
+                print("Using fallback encoding method...")
+                self.background_video.write_videofile(
+                    self.video_output_path, 
+                    audio=False,
+                    fps=self.quality["fps"],
+                    threads=optimal_threads,
+                    logger="bar",
+                    preset=self.quality["preset"],
+                    ffmpeg_params=["-crf", str(self.quality["crf"])]
+                )
         
         print(f"Saved video to {self.video_output_path}")
 
     def close_clips(self):
-        self.label_image_clip.close()
+        if self.label_image_clip is not None:
+            self.label_image_clip.close()
         for clip in self.clips:
             clip.close()
-        self.background_video.close()
+        if self.background_video is not None:
+            self.background_video.close()
         print("All used clips closed")
 
 
@@ -1,55 +1,208 @@
 import os
-import random
-import time
-from elevenlabs.client import ElevenLabs
-from elevenlabs import play
+import re
+import base64
+import hashlib
+import concurrent.futures
 
-from config import ELEVENLABS_API_KEY, VOICES
+from config import VOICES, TTS_CHUNK_CHARS, TTS_MIN_CHUNK_CHARS, TTS_MAX_CONCURRENCY
+from video_generator.metrics import span
+from video_generator.api_client import elevenlabs_client
+from video_generator.timings import words_from_character_alignment
+from video_generator.voice_cache import voice_cache
+from video_generator.pcm import SAMPLE_RATE, decode_audio, write_wav, fade_edges, active_rms
 
+import numpy as np
 from moviepy import AudioFileClip 
 
-client = ElevenLabs(
-  api_key=ELEVENLABS_API_KEY,
-)
+VOICE_MODEL_ID = "eleven_multilingual_v2"
+VOICE_OUTPUT_FORMAT = "mp3_44100_128"
 
-# Cache directory for storing generated voices to avoid regenerating the same ones
-VOICE_CACHE_DIR = "temp/voice_cache"
-os.makedirs(VOICE_CACHE_DIR, exist_ok=True)
+# Length of the fades at the joins between chunks
+CHUNK_FADE_SECONDS = 0.005
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def resolve_voice_name(voice_name, text):
+    """Pick the voice for "random" from the text, so a story always gets the same one."""
+    if voice_name != "random":
+        return voice_name
+    names = sorted(VOICES)
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return names[int.from_bytes(digest[:8], "big") % len(names)]
+
+def _split_paragraph(paragraph, max_chars):
+    pieces = []
+    current = ""
+    for sentence in _SENTENCE_END.split(paragraph):
+        # A single sentence over the budget is cut at word boundaries
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        candidate = f"{current} {sentence}" if current else sentence
+        if current and len(candidate) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+def split_text(text, max_chars=TTS_CHUNK_CHARS, min_chars=TTS_MIN_CHUNK_CHARS):
+    """Split text into TTS chunks at paragraph and sentence boundaries.
+
+    Chunks follow the paragraphs, so editing one paragraph only changes the
+    chunk it is in and every other chunk stays cached.
+    """
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = " ".join(paragraph.split())
+        if paragraph:
+            pieces.extend(_split_paragraph(paragraph, max_chars))
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and (len(current) >= min_chars or len(current) + 1 + len(piece) > max_chars):
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks or [text]
+
+def synthesize(text, voice_id, output_path, span_name="tts"):
+    """Write the speech for text to output_path, from the cache when possible, and return its alignment."""
+    cache_key = voice_cache.key(text, voice_id, VOICE_MODEL_ID, VOICE_OUTPUT_FORMAT)
+    cached = voice_cache.get(cache_key, output_path)
+    if cached is not None:
+        print(f"Using cached voice audio {cache_key[:12]} for {os.path.basename(output_path)}")
+        # Voices cached before alignments were stored fall back to Whisper
+        return cached["alignment"]
+
+    print(f"Generating new voice audio for {os.path.basename(output_path)}")
+    alignment = None
+    with span(span_name, output_path=output_path):
+        # The timestamps endpoint returns the audio together with a character
+        # alignment, so captions don't need to transcribe the audio afterwards
+        response = elevenlabs_client().request(
+            "POST", f"/v1/text-to-speech/{voice_id}/with-timestamps",
+            operation="tts",
+            hedge=True,
+            params={"output_format": VOICE_OUTPUT_FORMAT},
+            json={"text": text, "model_id": VOICE_MODEL_ID}
+        ).json()
+        with open(output_path, "wb") as f:
+            f.write(base64.b64decode(response["audio_base64"]))
+        if response.get("alignment"):
+            alignment = words_from_character_alignment(
+                response["alignment"]["characters"],
+                response["alignment"]["character_start_times_seconds"],
+                response["alignment"]["character_end_times_seconds"]
+            )
+    voice_cache.put(cache_key, output_path, alignment)
+    return alignment
+
+def synthesize_chunks(chunks, voice_id, folder, stem="chunk", max_concurrency=TTS_MAX_CONCURRENCY, span_name="tts"):
+    """Synthesize chunks concurrently and yield (index, path, alignment) in order.
+
+    A chunk is yielded as soon as it and every chunk before it are done, so a
+    Voice decodes and levels the first chunks while the rest are in flight.
+    Nothing later in the render starts before the whole voice is stitched; the
+    background listing and label are prepared on another thread meanwhile.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = []
+        for i, chunk in enumerate(chunks):
+            chunk_path = os.path.join(folder, f"{stem}_{i:03d}.mp3")
+            futures.append((chunk_path, executor.submit(synthesize, chunk, voice_id, chunk_path, span_name)))
+
+        for i, (chunk_path, future) in enumerate(futures):
+            yield i, chunk_path, future.result()
 
 class Voice:
     def __init__(self, voice_name, text, file_name, save_folder="temp"):
         self._output_path = os.path.join(save_folder, file_name)
         self.save_folder = save_folder  
         self.files_saved = []
+        # Word timings relative to the start of this voice, None when the TTS gave none
+        self.alignment = None
+        self._samples = None
+        self._audio_clip = None
         
-        # Use random voice if specified
+        self.voice_name = resolve_voice_name(voice_name, text)
         if voice_name == "random":
-            self._get_random_voice()
-        else:
-            self.voice_name = voice_name
-            
-        # Generate a unique cache key based on text content and voice
-        self.cache_key = f"{self.voice_name}_{hash(text)}"
-        self.cache_path = os.path.join(VOICE_CACHE_DIR, f"{self.cache_key}.mp3")
-        
-        # Check cache first
-        if os.path.exists(self.cache_path):
-            print(f"Using cached voice audio: {self.cache_path}")
-            # Copy from cache to output path
-            self._copy_from_cache()
+            print(f"Selected voice for {self._output_path}: {self.voice_name}")
+        os.makedirs(os.path.dirname(self._output_path) or ".", exist_ok=True)
+
+        self.chunks = split_text(text)
+        span_name = f"tts_{os.path.splitext(file_name)[0]}"
+        if len(self.chunks) == 1:
+            self.alignment = synthesize(self.chunks[0], VOICES[self.voice_name], self._output_path, span_name)
+            self.files_saved.append(self._output_path)
+            # Decoded here, on the voice's own thread, and handed to the mixer as PCM
+            self._samples = decode_audio(self._output_path)
         else:
-            # Generate new audio if not cached
-            print(f"Generating new voice audio for {file_name}")
-            self._generate_voice(text, file_name)
-            # Save to cache for future use
-            self._save_to_cache()
-            
-        # Load the audio clip
-        self._audio_clip = AudioFileClip(self._output_path)
+            print(f"Generating {file_name} in {len(self.chunks)} chunks")
+            self._generate_chunked(os.path.splitext(file_name)[0], span_name)
+
+    def _generate_chunked(self, stem, span_name):
+        segments = []
+        alignment = []
+        position = 0
+        target_rms = None
+        fade_samples = int(CHUNK_FADE_SECONDS * SAMPLE_RATE)
+
+        for i, chunk_path, chunk_alignment in synthesize_chunks(
+                self.chunks, VOICES[self.voice_name], self.save_folder, stem=stem, span_name=span_name):
+            self.files_saved.append(chunk_path)
+
+            samples = decode_audio(chunk_path)
+            # Requests come back at slightly different levels, match them to the first chunk
+            rms = active_rms(samples)
+            if target_rms is None:
+                target_rms = rms
+            elif rms > 0:
+                samples = samples * min(max(target_rms / rms, 0.7), 1.4)
+            segments.append(fade_edges(samples, fade_samples))
+
+            if alignment is not None and chunk_alignment is not None:
+                offset = position / SAMPLE_RATE
+                alignment.extend({
+                    "word": word["word"],
+                    "start": word["start"] + offset,
+                    "end": word["end"] + offset
+                } for word in chunk_alignment)
+            else:
+                alignment = None
+            position += len(samples)
+
+        # Kept as PCM, so the stitched track is never encoded to mp3 again
+        self._samples = np.concatenate(segments)
+        self._output_path = os.path.join(self.save_folder, f"{stem}.wav")
+        with span("tts_stitch", output_path=self._output_path):
+            write_wav(self._samples, self._output_path)
+        self.files_saved.append(self._output_path)
+        self.alignment = alignment
+        print(f"Stitched {len(segments)} chunks into {self._output_path}")
+
+    @property
+    def samples(self):
+        """The voice as float32 PCM, decoded the first time it is needed."""
+        if self._samples is None:
+            self._samples = decode_audio(self._output_path)
+        return self._samples
 
     @property
     def duration(self):
-        return self._audio_clip.duration
+        return len(self.samples) / SAMPLE_RATE
 
     @property
     def output_path(self):
@@ -57,47 +210,15 @@ class Voice:
 
     @property
     def audio_clip(self):
+        # Only opened for callers that still want a moviepy clip
+        if self._audio_clip is None:
+            self._audio_clip = AudioFileClip(self._output_path)
         return self._audio_clip
 
-    def _get_random_voice(self):
-        self.voice_name = random.choice(list(VOICES.keys()))
-        print(f"Selected voice for {self._output_path}: {self.voice_name}")
-
-    def _generate_voice(self, text, file_name):
-        start_time = time.time()
-        response = client.text_to_speech.convert(
-            text=text,
-            voice_id=VOICES[self.voice_name],
-            model_id="eleven_multilingual_v2",
-            output_format="mp3_44100_128",
-        )
-        self._save_audio(response, self._output_path)
-        print(f"Voice generation took {time.time() - start_time:.2f} seconds")
-
-    def _save_audio(self, response, output_path):
-        with open(output_path, "wb") as f:
-            for chunk in response:
-                if chunk:
-                    f.write(chunk)
-        self.files_saved.append(output_path)
-        print(f"Voice generated and saved to {self._output_path}")
-        
-    def _copy_from_cache(self):
-        """Copy the cached audio file to the output path"""
-        import shutil
-        os.makedirs(os.path.dirname(self._output_path), exist_ok=True)
-        shutil.copy2(self.cache_path, self._output_path)
-        self.files_saved.append(self._output_path)
-        print(f"Copied cached voice from {self.cache_path} to {self._output_path}")
-        
-    def _save_to_cache(self):
-        """Save the generated audio to the cache directory"""
-        import shutil
-        shutil.copy2(self._output_path, self.cache_path)
-        print(f"Saved voice to cache: {self.cache_path}")
-
     def delete(self):
-        self._audio_clip.close()
+        if self._audio_clip is not None:
+            self._audio_clip.close()
+        self._samples = None
         #os.remove(self._output_path)
         print(f"Deleted audio file: {self._output_path}")
 
@@ -0,0 +1,176 @@
+import hashlib
+import fcntl
+import json
+import shutil
+import threading
+import time
+import os
+from contextlib import contextmanager
+
+from config import VOICE_CACHE_MAX_BYTES
+
+# Cache directory for storing generated voices to avoid regenerating the same ones,
+# moved through the environment by the benchmark
+VOICE_CACHE_DIR = os.environ.get("VOICE_CACHE_DIR", "temp/voice_cache")
+
+class VoiceCache:
+    """Generated voices keyed by a digest of everything that decides the audio.
+
+    Every entry is <key>.mp3 plus an optional <key>.json alignment. index.json
+    keeps the size and last access of each entry and is only read or written
+    under an exclusive flock, so worker processes can share the directory.
+    Files are written under a temporary name and renamed into place, so a
+    reader never sees a partial mp3.
+    """
+
+    def __init__(self, folder=VOICE_CACHE_DIR, max_bytes=VOICE_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(folder, "index.json")
+        self.lock_path = os.path.join(folder, "index.lock")
+        self.hits = 0
+        self.misses = 0
+        self._thread_lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+    @staticmethod
+    def key(text, voice_id, model_id, output_format):
+        payload = json.dumps([text, voice_id, model_id, output_format], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _audio_path(self, key):
+        return os.path.join(self.folder, f"{key}.mp3")
+
+    def _alignment_path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    @contextmanager
+    def _locked_index(self):
+        # The thread lock covers threads of one process, flock covers the other workers
+        with self._thread_lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = self._load_index()
+                yield index
+                self._write_index(index)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return self._rebuild_index()
+
+    def _rebuild_index(self):
+        # Picks up every mp3 in the folder, including ones written before there
+        # was an index, so they are evicted like any other entry
+        index = {}
+        for name in os.listdir(self.folder):
+            if not name.endswith(".mp3"):
+                continue
+            key = name[:-len(".mp3")]
+            try:
+                stat = os.stat(self._audio_path(key))
+            except OSError:
+                continue
+            index[key] = {"size": stat.st_size + self._alignment_size(key), "last_access": stat.st_mtime}
+        print(f"Rebuilt voice cache index with {len(index)} entries")
+        return index
+
+    def _alignment_size(self, key):
+        try:
+            return os.path.getsize(self._alignment_path(key))
+        except OSError:
+            return 0
+
+    def _write_index(self, index):
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(temp_path, self.index_path)
+
+    def contains(self, key):
+        return os.path.exists(self._audio_path(key))
+
+    def get(self, key, output_path):
+        """Copy a cached voice to output_path and return its entry, or None on a miss.
+
+        Only the index lookup holds the lock. The entry's files are hard-linked
+        under it and copied after, so an eviction in between can't remove them.
+        """
+        suffix = f"{os.getpid()}.{threading.get_ident()}.read"
+        audio_link = f"{self._audio_path(key)}.{suffix}"
+        alignment_link = f"{self._alignment_path(key)}.{suffix}"
+        with self._locked_index() as index:
+            entry = index.get(key)
+            if entry is not None:
+                try:
+                    os.link(self._audio_path(key), audio_link)
+                except FileNotFoundError:
+                    del index[key]
+                    entry = None
+            if entry is not None:
+                entry["last_access"] = time.time()
+                try:
+                    os.link(self._alignment_path(key), alignment_link)
+                except FileNotFoundError:
+                    alignment_link = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        alignment = None
+        try:
+            shutil.copyfile(audio_link, output_path)
+            if alignment_link:
+                with open(alignment_link) as f:
+                    alignment = json.load(f)
+        finally:
+            for path in (audio_link, alignment_link):
+                if path:
+                    os.remove(path)
+        return {"alignment": alignment}
+
+    def put(self, key, audio_path, alignment=None):
+        suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+        temp_audio_path = f"{self._audio_path(key)}.{suffix}"
+        shutil.copyfile(audio_path, temp_audio_path)
+        if alignment is not None:
+            temp_alignment_path = f"{self._alignment_path(key)}.{suffix}"
+            with open(temp_alignment_path, "w") as f:
+                json.dump(alignment, f, separators=(",", ":"))
+            os.replace(temp_alignment_path, self._alignment_path(key))
+        os.replace(temp_audio_path, self._audio_path(key))
+
+        with self._locked_index() as index:
+            index[key] = {
+                "size": os.path.getsize(self._audio_path(key)) + self._alignment_size(key),
+                "last_access": time.time()
+            }
+            self._evict(index)
+
+    def _evict(self, index):
+        total = sum(entry["size"] for entry in index.values())
+        for key in sorted(index, key=lambda key: index[key]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            total -= index.pop(key)["size"]
+            for path in (self._audio_path(key), self._alignment_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            print(f"Evicted voice {key[:12]} from cache")
+
+    def stats(self):
+        with self._locked_index() as index:
+            entries = len(index)
+            total = sum(entry["size"] for entry in index.values())
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total}
+
+# Shared by every Voice in the process
+voice_cache = VoiceCache()
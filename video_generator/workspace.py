@@ -0,0 +1,26 @@
+import shutil
+import uuid
+import os
+
+# Every render gets its own scratch directory under here
+JOBS_TEMP_DIR = "temp/jobs"
+
+class Workspace:
+    def __init__(self, job_id=None, root=JOBS_TEMP_DIR):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.path = os.path.abspath(os.path.join(root, self.job_id))
+        os.makedirs(self.path, exist_ok=True)
+        print(f"Using workspace {self.path}")
+
+    def folder(self, name):
+        folder_path = os.path.join(self.path, name)
+        os.makedirs(folder_path, exist_ok=True)
+        return folder_path
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def cleanup(self):
+        # Only this job's directory is touched, so concurrent renders are left alone
+        shutil.rmtree(self.path, ignore_errors=True)
+        print(f"Removed workspace {self.path}")